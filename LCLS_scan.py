@@ -23,8 +23,11 @@ import math
 from copy import deepcopy
 from Raster import Raster, RasterItem
 from motorThread import MotorThread
+from commandQueue import CommandQueue
+from jogEngine import JogEngine
 from numpy import arctan
 from dataCollectionThread import LCLScollector
+from scanJournal import ScanJournal
 from filesystem import Filesystem
 from autofocus import AutoFocus
 from PyTango import *
@@ -83,6 +86,7 @@ class StartQT4(QtGui.QMainWindow):
         self.filesystem.setSample("blupp")
         print "Filesystem path:",self.filesystem.getPath(self.filesystem.FS_ROOT_LOCAL+self.filesystem.FS_SUB_PROCESSED+self.filesystem.FS_TYPE_SCAN)
         self.raster = RasterItem()
+        self.autofocus = None
         
         
 
@@ -153,10 +157,15 @@ class StartQT4(QtGui.QMainWindow):
         QtCore.QObject.connect(self.ui.pushButtonStopAll,QtCore.SIGNAL("clicked()"), self.stopAll)
         QtCore.QObject.connect(self.ui.pushButtonStopAll2,QtCore.SIGNAL("clicked()"), self.stopAll)
         
-        QtCore.QObject.connect(self.ui.pushButtonUp,QtCore.SIGNAL("clicked()"), self.moveUp)
-        QtCore.QObject.connect(self.ui.pushButtonDown,QtCore.SIGNAL("clicked()"), self.moveDown)
-        QtCore.QObject.connect(self.ui.pushButtonLeft,QtCore.SIGNAL("clicked()"), self.moveLeft)
-        QtCore.QObject.connect(self.ui.pushButtonRight,QtCore.SIGNAL("clicked()"), self.moveRight)
+        # a click jogs one step, holding a button moves the axis until it is released
+        QtCore.QObject.connect(self.ui.pushButtonUp,QtCore.SIGNAL("pressed()"), self.moveUp)
+        QtCore.QObject.connect(self.ui.pushButtonDown,QtCore.SIGNAL("pressed()"), self.moveDown)
+        QtCore.QObject.connect(self.ui.pushButtonLeft,QtCore.SIGNAL("pressed()"), self.moveLeft)
+        QtCore.QObject.connect(self.ui.pushButtonRight,QtCore.SIGNAL("pressed()"), self.moveRight)
+        QtCore.QObject.connect(self.ui.pushButtonUp,QtCore.SIGNAL("released()"), lambda: self.jogEngine.release("ScanY"))
+        QtCore.QObject.connect(self.ui.pushButtonDown,QtCore.SIGNAL("released()"), lambda: self.jogEngine.release("ScanY"))
+        QtCore.QObject.connect(self.ui.pushButtonLeft,QtCore.SIGNAL("released()"), lambda: self.jogEngine.release("ScanX"))
+        QtCore.QObject.connect(self.ui.pushButtonRight,QtCore.SIGNAL("released()"), lambda: self.jogEngine.release("ScanX"))
         QtCore.QObject.connect(self.ui.pushButtonResetMotors,QtCore.SIGNAL("clicked()"), self.moveZero)
         
         QtCore.QObject.connect(self.ui.pushButtonSetTopLeftCoarse,QtCore.SIGNAL("clicked()"), self.setTopLeftCoarse)
@@ -214,6 +223,27 @@ class StartQT4(QtGui.QMainWindow):
             gonioZmountposition = config.get('ISMOscan', 'gonioZmountposition')
             self.cameraServer = config.get('Camera', 'cameraserver')
             self.cameraPort = int(config.get('Camera', 'cameraport'))
+            motorEvents = config.has_option('ISMOscan', 'motorevents') and config.getboolean('ISMOscan', 'motorevents')
+            self.scanMode = "sequential"
+            if config.has_option('ISMOscan', 'scanmode'):
+                self.scanMode = config.get('ISMOscan', 'scanmode')
+            self.retryMode = "end"
+            self.maxRetries = 2
+            self.stableTime = 10.0
+            if config.has_option('ISMOscan', 'beamdumpretry'):
+                self.retryMode = config.get('ISMOscan', 'beamdumpretry')
+            if config.has_option('ISMOscan', 'beamdumpretries'):
+                self.maxRetries = config.getint('ISMOscan', 'beamdumpretries')
+            if config.has_option('ISMOscan', 'beamstabletime'):
+                self.stableTime = config.getfloat('ISMOscan', 'beamstabletime')
+            statsInterval = 0
+            if config.has_option('ISMOscan', 'statsinterval'):
+                statsInterval = float(config.get('ISMOscan', 'statsinterval'))
+            pollRates = {}
+            if config.has_section('PollRates'):
+                for device, rates in config.items('PollRates'):
+                    moving, idle = rates.split(",")
+                    pollRates[device] = (float(moving), float(idle))
             
             
             motorServers = [motorScanController, motorStepperController, motorScanXDevname, \
@@ -221,17 +251,26 @@ class StartQT4(QtGui.QMainWindow):
                             motorOnaxisXDevname, motorOnaxisYDevname, motorOnaxisZDevname, \
                             motorBeamstopXDevname, motorBeamstopYDevname]
             
-            self.motorThread = MotorThread(motorServers,onaxisZmountposition,gonioZmountposition)
-            self.connect(self.motorThread,SIGNAL("update()"),self.updatePositions)
+            self.motorThread = MotorThread(motorServers,onaxisZmountposition,gonioZmountposition,useEvents=motorEvents,pollRates=pollRates,statsInterval=statsInterval)
+            # widgets showing each axis, with the format of its position
+            self.axisLabels = { \
+                "ScanX": ((self.ui.labelScanXposition,), "%.1f " + unichr(956) + "m"), \
+                "ScanY": ((self.ui.labelScanYposition,), "%.1f " + unichr(956) + "m"), \
+                "Gonio": ((self.ui.labelGonioAngle, self.ui.labelGonioAngle_2), "%.3f" + unichr(176)), \
+                "GonioZ": ((self.ui.labelGonioZposition,), "%.1f " + unichr(956) + "m"), \
+                "OnaxisX": ((self.ui.labelOnaxisXposition,), "%.1f " + unichr(956) + "m"), \
+                "OnaxisY": ((self.ui.labelOnaxisYposition,), "%.1f " + unichr(956) + "m"), \
+                "OnaxisZ": ((self.ui.labelOnaxisZposition,), "%.1f " + unichr(956) + "m"), \
+                "BeamstopX": ((self.ui.labelBeamstopXposition,), "%.1f " + unichr(956) + "m"), \
+                "BeamstopY": ((self.ui.labelBeamstopYposition,), "%.1f " + unichr(956) + "m"), \
+            }
+            self.shownStates = {}
+            self.connect(self.motorThread,SIGNAL("update(PyQt_PyObject)"),self.updatePositions)
+            # the motor thread connects its devices in the background, limits arrive with limitsChanged()
+            self.connect(self.motorThread,SIGNAL("limitsChanged()"),self.updateLimits)
+            self.jogEngine = JogEngine(self.motorThread)
             self.motorThread.start()
-            time.sleep(0.5)
-            self.ui.horizontalSliderXPosition.setMinimum(int(self.motorThread.scanXMin))
-            self.ui.horizontalSliderXPosition.setMaximum(int(self.motorThread.scanXMax))
-            self.ui.horizontalSliderXPosition.setValue(int(self.motorThread.currentScanX))
-            
-            self.ui.verticalSliderYPosition.setMinimum(int(self.motorThread.scanYMin))
-            self.ui.verticalSliderYPosition.setMaximum(int(self.motorThread.scanYMax))
-            self.ui.verticalSliderYPosition.setValue(int(self.motorThread.currentScanY))
+            self.updateLimits()
             
             self.ui.doubleSpinBoxScanXposition.setValue(self.motorThread.currentScanX)
             self.ui.doubleSpinBoxScanYposition.setValue(self.motorThread.currentScanY)
@@ -489,41 +528,41 @@ class StartQT4(QtGui.QMainWindow):
                     self.beamoffsetY = self.ui.spinBoxBeamY.value()
                     self.saveSettings()
                 if (w == self.ui.doubleSpinBoxScanXposition):
-                    self.motorThread.setScanX(self.ui.doubleSpinBoxScanXposition.value())
+                    self.motorThread.submit("setScanX", (self.ui.doubleSpinBoxScanXposition.value(),))
                 if (w == self.ui.doubleSpinBoxScanYposition):
-                    self.motorThread.setScanY(self.ui.doubleSpinBoxScanYposition.value())
+                    self.motorThread.submit("setScanY", (self.ui.doubleSpinBoxScanYposition.value(),))
                 if (w == self.ui.doubleSpinBoxGonioAngle):
-                    self.motorThread.setGonio(self.ui.doubleSpinBoxGonioAngle.value())                    
+                    self.motorThread.submit("setGonio", (self.ui.doubleSpinBoxGonioAngle.value(),))                    
                 if (w == self.ui.doubleSpinBoxGonioAngle_2):
-                    self.motorThread.setGonio(self.ui.doubleSpinBoxGonioAngle_2.value())
+                    self.motorThread.submit("setGonio", (self.ui.doubleSpinBoxGonioAngle_2.value(),))
                 if (w == self.ui.doubleSpinBoxGonioZposition):
-                    self.motorThread.setGonioZ(self.ui.doubleSpinBoxGonioZposition.value())
+                    self.motorThread.submit("setGonioZ", (self.ui.doubleSpinBoxGonioZposition.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisXposition):
-                    self.motorThread.setOnaxisX(self.ui.doubleSpinBoxOnaxisXposition.value())
+                    self.motorThread.submit("setOnaxisX", (self.ui.doubleSpinBoxOnaxisXposition.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisYposition):
-                    self.motorThread.setOnaxisY(self.ui.doubleSpinBoxOnaxisYposition.value())
+                    self.motorThread.submit("setOnaxisY", (self.ui.doubleSpinBoxOnaxisYposition.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisZposition):
-                    self.motorThread.setOnaxisZ(self.ui.doubleSpinBoxOnaxisZposition.value())
+                    self.motorThread.submit("setOnaxisZ", (self.ui.doubleSpinBoxOnaxisZposition.value(),))
                 if (w == self.ui.doubleSpinBoxBeamstopXposition):
-                    self.motorThread.setBeamstopX(self.ui.doubleSpinBoxBeamstopXposition.value())
+                    self.motorThread.submit("setBeamstopX", (self.ui.doubleSpinBoxBeamstopXposition.value(),))
                 if (w == self.ui.doubleSpinBoxBeamstopYposition):
-                    self.motorThread.setBeamstopY(self.ui.doubleSpinBoxBeamstopYposition.value())
+                    self.motorThread.submit("setBeamstopY", (self.ui.doubleSpinBoxBeamstopYposition.value(),))
                 
                     
                 if (w == self.ui.doubleSpinBoxGonioAngle_calib):
-                    self.motorThread.calibrateGonio(self.ui.doubleSpinBoxGonioAngle_calib.value())
+                    self.motorThread.submit("calibrateGonio", (self.ui.doubleSpinBoxGonioAngle_calib.value(),))
                 if (w == self.ui.doubleSpinBoxGoniometerZposition_calib):
-                    self.motorThread.calibrateGonioZ(self.ui.doubleSpinBoxGoniometerZposition_calib.value())
+                    self.motorThread.submit("calibrateGonioZ", (self.ui.doubleSpinBoxGoniometerZposition_calib.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisXposition_calib):
-                    self.motorThread.calibrateOnaxisX(self.ui.doubleSpinBoxOnaxisXposition_calib.value())
+                    self.motorThread.submit("calibrateOnaxisX", (self.ui.doubleSpinBoxOnaxisXposition_calib.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisYposition_calib):
-                    self.motorThread.calibrateOnaxisY(self.ui.doubleSpinBoxOnaxisYposition_calib.value())
+                    self.motorThread.submit("calibrateOnaxisY", (self.ui.doubleSpinBoxOnaxisYposition_calib.value(),))
                 if (w == self.ui.doubleSpinBoxOnaxisZposition_calib):
-                    self.motorThread.calibrateOnaxisZ(self.ui.doubleSpinBoxOnaxisZposition_calib.value())
+                    self.motorThread.submit("calibrateOnaxisZ", (self.ui.doubleSpinBoxOnaxisZposition_calib.value(),))
                 if (w == self.ui.doubleSpinBoxBeamstopXposition_calib):
-                    self.motorThread.calibrateBeamstopX(self.ui.doubleSpinBoxBeamstopXposition_calib.value())
+                    self.motorThread.submit("calibrateBeamstopX", (self.ui.doubleSpinBoxBeamstopXposition_calib.value(),))
                 if (w == self.ui.doubleSpinBoxBeamstopYposition_calib):
-                    self.motorThread.calibrateBeamstopY(self.ui.doubleSpinBoxBeamstopYposition_calib.value())
+                    self.motorThread.submit("calibrateBeamstopY", (self.ui.doubleSpinBoxBeamstopYposition_calib.value(),))
                 if (w == self.ui.spinBoxGotoRowNumber):
                     self.goToRowHole()
                 if (w == self.ui.spinBoxGotoHoleNumber):
@@ -839,6 +878,7 @@ class StartQT4(QtGui.QMainWindow):
             
     def frameGrabbed(self):
         if self.camera.getFrame() is None: return
+        self.updateGridSize()
         if self.ui.checkBoxAutoExposure.isChecked():
             exposureInfo = self.camera.getCmdInfo(MjpgStream.IN_CMD_AVT_EXPOSURE_VALUE)
             if(exposureInfo):
@@ -946,22 +986,65 @@ class StartQT4(QtGui.QMainWindow):
         self.sceneLiveview.addItem(self.ellipseItem)
         self.ui.graphicsviewLiveview.update()
 
-    def updatePositions(self):
-        self.ui.labelScanXposition.setText("%.1f " % self.motorThread.currentScanX + unichr(956) + "m")
-        self.ui.labelScanYposition.setText("%.1f " % self.motorThread.currentScanY + unichr(956) + "m")
-        self.ui.labelGonioAngle.setText("%.3f" % self.motorThread.currentGonio + unichr(176))
-        self.ui.labelGonioAngle_2.setText("%.3f" % self.motorThread.currentGonio + unichr(176))
+    def updateLimits(self):
+        self.ui.horizontalSliderXPosition.setMinimum(int(self.motorThread.scanXMin))
+        self.ui.horizontalSliderXPosition.setMaximum(int(self.motorThread.scanXMax))
         self.ui.horizontalSliderXPosition.setValue(int(self.motorThread.currentScanX))
+        self.ui.verticalSliderYPosition.setMinimum(int(self.motorThread.scanYMin))
+        self.ui.verticalSliderYPosition.setMaximum(int(self.motorThread.scanYMax))
         self.ui.verticalSliderYPosition.setValue(int(self.motorThread.currentScanY))
         
-        self.ui.labelGonioZposition.setText("%.1f " % self.motorThread.currentGonioZ + unichr(956) + "m")
-        self.ui.labelOnaxisXposition.setText("%.1f " % self.motorThread.currentOnaxisX + unichr(956) + "m")
-        self.ui.labelOnaxisYposition.setText("%.1f " % self.motorThread.currentOnaxisY + unichr(956) + "m")
-        self.ui.labelOnaxisZposition.setText("%.1f " % self.motorThread.currentOnaxisZ + unichr(956) + "m")
-        self.ui.labelBeamstopXposition.setText("%.1f " % self.motorThread.currentBeamstopX + unichr(956) + "m")
-        self.ui.labelBeamstopYposition.setText("%.1f " % self.motorThread.currentBeamstopY + unichr(956) + "m")
-        
-        self.ui.checkBoxScanRunning.setChecked(self.motorThread.stateTask1)
+    def updatePositions(self, changes=None):
+        # changes holds (state, value) of the devices that changed since the last update,
+        # only their widgets are touched. None refreshes all of them.
+        if changes is None:
+            changes = {"ScanController": (self.motorThread.stateProxyScanController, self.motorThread.stateTask1)}
+            for axis in self.motorThread.AXES:
+                changes[axis] = (getattr(self.motorThread, "stateProxy" + axis), getattr(self.motorThread, "current" + axis))
+            self.shownStates = {}
+        for device, (state, value) in changes.items():
+            if device == "ScanController":
+                self.ui.checkBoxScanRunning.setChecked(bool(value))
+                continue
+            if device not in self.axisLabels:
+                continue
+            labels, format = self.axisLabels[device]
+            for label in labels:
+                label.setText(format % value)
+            if device == "ScanX":
+                self.ui.horizontalSliderXPosition.setValue(int(value))
+            elif device == "ScanY":
+                self.ui.verticalSliderYPosition.setValue(int(value))
+            if self.shownStates.get(device) == state:
+                continue
+            self.shownStates[device] = state
+            if state == DevState.MOVING:
+                styleSheet = "background-color: yellow"
+            elif state == DevState.ON:
+                styleSheet = "background-color: lightgreen"
+            else:
+                styleSheet = "background-color: red"
+            for label in labels:
+                label.setStyleSheet(styleSheet)
+            # jog buttons stay enabled while moving, so clicks can add up and held buttons see their release
+            if device == "ScanX":
+                self.ui.pushButtonLeft.setEnabled(state in (DevState.ON, DevState.MOVING))
+                self.ui.pushButtonRight.setEnabled(state in (DevState.ON, DevState.MOVING))
+            elif device == "ScanY":
+                self.ui.pushButtonUp.setEnabled(state in (DevState.ON, DevState.MOVING))
+                self.ui.pushButtonDown.setEnabled(state in (DevState.ON, DevState.MOVING))
+            elif device == "OnaxisZ":
+                self.updateMountButton()
+        if "OnaxisZ" in changes or "GonioZ" in changes:
+            if self.motorThread.inMountPosition:
+                self.ui.pushButtonSetMountPosition.setText("Set sample position")
+            else:
+                self.ui.pushButtonSetMountPosition.setText("Set mount position")
+    
+    def updateMountButton(self):
+        self.ui.pushButtonSetMountPosition.setEnabled(self.motorThread.stateProxyOnaxisZ != DevState.MOVING and self.autofocus is None)
+    
+    def updateGridSize(self):
         if self.raster is not None:
             grid = self.raster.raster.getScanRows()
             if grid is not None and (len(grid) > 0):
@@ -972,98 +1055,6 @@ class StartQT4(QtGui.QMainWindow):
                     self.ui.spinBoxGridHeight.setValue(gridHeight)
             else:
                 self.ui.spinBoxGridWidth.setValue(0)
-        
-        if self.motorThread.stateProxyScanX == DevState.MOVING:
-            self.ui.labelScanXposition.setStyleSheet("background-color: yellow")
-            self.ui.pushButtonLeft.setEnabled(False)
-            self.ui.pushButtonRight.setEnabled(False)
-        elif self.motorThread.stateProxyScanX == DevState.ON:
-            self.ui.labelScanXposition.setStyleSheet("background-color: lightgreen")
-            self.ui.pushButtonLeft.setEnabled(True)
-            self.ui.pushButtonRight.setEnabled(True)
-        else:
-            self.ui.labelScanXposition.setStyleSheet("background-color: red")
-            self.ui.pushButtonLeft.setEnabled(False)
-            self.ui.pushButtonRight.setEnabled(False)
-        
-        if self.motorThread.stateProxyScanY == DevState.MOVING:
-            self.ui.labelScanYposition.setStyleSheet("background-color: yellow")
-            self.ui.pushButtonUp.setEnabled(False)
-            self.ui.pushButtonDown.setEnabled(False)
-        elif self.motorThread.stateProxyScanY == DevState.ON:
-            self.ui.labelScanYposition.setStyleSheet("background-color: lightgreen")
-            self.ui.pushButtonUp.setEnabled(True)
-            self.ui.pushButtonDown.setEnabled(True)
-        else:
-            self.ui.labelScanYposition.setStyleSheet("background-color: red")
-            self.ui.pushButtonUp.setEnabled(False)
-            self.ui.pushButtonDown.setEnabled(False)
-            
-            
-        if self.motorThread.inMountPosition:
-            self.ui.pushButtonSetMountPosition.setText("Set sample position")
-        else:
-            self.ui.pushButtonSetMountPosition.setText("Set mount position")
-
-        if self.motorThread.stateProxyOnaxisZ == DevState.MOVING or self.autofocus is not None:
-            self.ui.pushButtonSetMountPosition.setEnabled(False)
-        else:
-            self.ui.pushButtonSetMountPosition.setEnabled(True)
-            
-        
-        if self.motorThread.stateProxyGonio == DevState.MOVING:
-            self.ui.labelGonioAngle.setStyleSheet("background-color: yellow")
-            self.ui.labelGonioAngle_2.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyGonio == DevState.ON:
-            self.ui.labelGonioAngle.setStyleSheet("background-color: lightgreen")
-            self.ui.labelGonioAngle_2.setStyleSheet("background-color: lightgreen")
-        else:
-            self.ui.labelGonioAngle.setStyleSheet("background-color: red")
-            self.ui.labelGonioAngle_2.setStyleSheet("background-color: red")
-             
-        if self.motorThread.stateProxyGonioZ == DevState.MOVING:
-            self.ui.labelGonioZposition.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyGonioZ == DevState.ON:
-            self.ui.labelGonioZposition.setStyleSheet("background-color: lightgreen")
-        else:
-            self.ui.labelGonioZposition.setStyleSheet("background-color: red")
-            
-        if self.motorThread.stateProxyOnaxisX == DevState.MOVING:
-            self.ui.labelOnaxisXposition.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyOnaxisX == DevState.ON:
-            self.ui.labelOnaxisXposition.setStyleSheet("background-color: lightgreen")   
-        else:
-            self.ui.labelOnaxisXposition.setStyleSheet("background-color: red")
-            
-        if self.motorThread.stateProxyOnaxisY == DevState.MOVING:
-            self.ui.labelOnaxisYposition.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyOnaxisY == DevState.ON:
-            self.ui.labelOnaxisYposition.setStyleSheet("background-color: lightgreen")   
-        else:
-            self.ui.labelOnaxisYposition.setStyleSheet("background-color: red")  
-             
-        if self.motorThread.stateProxyOnaxisZ == DevState.MOVING:
-            self.ui.labelOnaxisZposition.setStyleSheet("background-color: yellow")
-            self.ui.pushButtonSetMountPosition.setEnabled(False)
-        elif self.motorThread.stateProxyOnaxisZ == DevState.ON:
-            self.ui.labelOnaxisZposition.setStyleSheet("background-color: lightgreen")
-            self.ui.pushButtonSetMountPosition.setEnabled(True)   
-        else:
-            self.ui.labelOnaxisZposition.setStyleSheet("background-color: red")
-             
-        if self.motorThread.stateProxyBeamstopX == DevState.MOVING:
-            self.ui.labelBeamstopXposition.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyBeamstopX == DevState.ON:
-            self.ui.labelBeamstopXposition.setStyleSheet("background-color: lightgreen")   
-        else:
-            self.ui.labelBeamstopXposition.setStyleSheet("background-color: red")
-            
-        if self.motorThread.stateProxyBeamstopY == DevState.MOVING:
-            self.ui.labelBeamstopYposition.setStyleSheet("background-color: yellow")
-        elif self.motorThread.stateProxyBeamstopY == DevState.ON:
-            self.ui.labelBeamstopYposition.setStyleSheet("background-color: lightgreen")   
-        else:
-            self.ui.labelBeamstopYposition.setStyleSheet("background-color: red")
 
     def setStepSize(self):
         self.ui.doubleSpinBoxScanXposition.setSingleStep(float((self.ui.comboBoxStepSize.currentText()[:-3])))
@@ -1079,46 +1070,41 @@ class StartQT4(QtGui.QMainWindow):
         
     def setScanX(self,position = None):
         if position is None:
-            self.motorThread.setScanX(self.ui.doubleSpinBoxScanXposition.value())
+            self.motorThread.submit("setScanX", (self.ui.doubleSpinBoxScanXposition.value(),))
         else:
-            self.motorThread.setScanX(position)
+            self.motorThread.submit("setScanX", (position,))
         
     def setScanY(self,position = None):
         if position is None:
-            self.motorThread.setScanY(self.ui.doubleSpinBoxScanYposition.value())
+            self.motorThread.submit("setScanY", (self.ui.doubleSpinBoxScanYposition.value(),))
         else:
-            self.motorThread.setScanY(position)
+            self.motorThread.submit("setScanY", (position,))
         
     def stopAll(self):
-        self.motorThread.stopMotors()
+        self.motorThread.submit("stopMotors", callback=self.stopDone, priority=CommandQueue.PRIORITY_STOP)
+    
+    def stopDone(self, notStopped):
+        if notStopped:
+            QtGui.QMessageBox.warning(self, 'Error',"Axes did not stop: " + ", ".join(notStopped), QtGui.QMessageBox.Ok)
+    
+    def jogStep(self):
+        return float((self.ui.comboBoxStepSize.currentText()[:-3]))
     
     def moveUp(self):
-        current = self.motorThread.currentScanY
-        increment = float((self.ui.comboBoxStepSize.currentText()[:-3]))
-        newpos = current - increment
-        self.motorThread.setScanY(newpos)
+        self.jogEngine.press("ScanY", -self.jogStep())
         
     def moveDown(self):
-        current = self.motorThread.currentScanY
-        increment = float((self.ui.comboBoxStepSize.currentText()[:-3]))
-        newpos = current + increment
-        self.motorThread.setScanY(newpos)
+        self.jogEngine.press("ScanY", self.jogStep())
         
     def moveLeft(self):
-        current = self.motorThread.currentScanX
-        increment = float((self.ui.comboBoxStepSize.currentText()[:-3]))
-        newpos = current - increment
-        self.motorThread.setScanX(newpos)
+        self.jogEngine.press("ScanX", -self.jogStep())
         
     def moveRight(self):
-        current = self.motorThread.currentScanX
-        increment = float((self.ui.comboBoxStepSize.currentText()[:-3]))
-        newpos = current + increment
-        self.motorThread.setScanX(newpos)
+        self.jogEngine.press("ScanX", self.jogStep())
         
     def moveZero(self):
-        self.motorThread.setScanX(0)
-        self.motorThread.setScanY(0)
+        self.motorThread.submit("setScanX", (0,))
+        self.motorThread.submit("setScanY", (0,))
         
     def setTopLeftCoarse(self):
         self.topLeftCoarse = (self.motorThread.currentScanX,self.motorThread.currentScanY)
@@ -1139,9 +1125,9 @@ class StartQT4(QtGui.QMainWindow):
         self.setScanY(self.topLeftCoarse[1]+600)
     def setMountPosition(self):
         if self.motorThread.inMountPosition:
-            self.motorThread.setMountPosition(False)
+            self.motorThread.submit("setMountPosition", (False,))
         else:
-            self.motorThread.setMountPosition(True)
+            self.motorThread.submit("setMountPosition", (True,))
             
     def startScan(self):
         self.saveSettings()
@@ -1169,11 +1155,31 @@ class StartQT4(QtGui.QMainWindow):
             self.LCLScollector.setParameter("gonioStop",self.ui.doubleSpinBoxEndAngleInc.value())
             self.LCLScollector.setParameter("startRow",self.ui.spinBoxScanStartRow.value())
             self.LCLScollector.setParameter("stopRow",self.ui.spinBoxScanStopRow.value())
+            self.LCLScollector.setParameter("mode",self.scanMode)
+            self.LCLScollector.setParameter("retryMode",self.retryMode)
+            self.LCLScollector.setParameter("maxRetries",self.maxRetries)
+            self.LCLScollector.setParameter("stableTime",self.stableTime)
+            
+            # the progress of every row is journaled next to the scan data, an interrupted scan can be resumed,
+            # the time spent in each phase of a row is logged alongside
+            scanPath = self.filesystem.getPath(self.filesystem.FS_ROOT_LOCAL+self.filesystem.FS_SUB_PROCESSED+self.filesystem.FS_TYPE_SCAN,True)
+            if scanPath:
+                journalFile = os.path.join(scanPath, "scan_journal.jsonl")
+                self.LCLScollector.setParameter("journal",journalFile)
+                self.LCLScollector.setParameter("telemetry",os.path.join(scanPath, "scan_telemetry.jsonl"))
+                selectedRows = len(rows[self.ui.spinBoxScanStartRow.value():self.ui.spinBoxScanStopRow.value()])
+                completed = ScanJournal(journalFile).resumable(self.LCLScollector.parameters, selectedRows)
+                if completed:
+                    answer = QtGui.QMessageBox.question(self, 'Resume scan', \
+                        "%d of %d rows of this scan were already completed. Resume the scan?" % (len(completed), selectedRows), \
+                        QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.Yes)
+                    self.LCLScollector.setParameter("resume",answer == QtGui.QMessageBox.Yes)
             
             
             self.LCLScollector.start()
             self.connect(self.LCLScollector,SIGNAL("scanUpdate()"),self.updateScan)
             self.connect(self.LCLScollector,SIGNAL("scanFinished()"),self.scanFinished)
+            self.connect(self.LCLScollector,SIGNAL("etaUpdate(PyQt_PyObject)"),self.updateEta)
             
             self.ui.pushButtonStartScan.setEnabled(False)
             self.ui.pushButtonAbortScan.setEnabled(True)
@@ -1196,7 +1202,15 @@ class StartQT4(QtGui.QMainWindow):
         else:
             self.ui.pushButtonStartScan.setEnabled(True)
             self.ui.pushButtonAbortScan.setEnabled(False)
+    def updateEta(self, eta):
+        if self.LCLScollector is None:
+            return
+        self.ui.progressBarScanStatus.setValue(int(eta["percent"]))
+        remaining = int(eta["remaining"])
+        self.ui.progressBarScanStatus.setFormat("%%p%% - %d:%02d:%02d left, done at %s" % \
+            (remaining / 3600, remaining / 60 % 60, remaining % 60, time.strftime("%H:%M", time.localtime(eta["eta"]))))
     def scanFinished(self):
+        self.ui.progressBarScanStatus.setFormat("%p%")
         self.ui.progressBarScanStatus.setValue(100)
         if self.LCLScollector is not None: self.LCLScollector.stop()
         self.LCLScollector = None
@@ -1206,6 +1220,9 @@ class StartQT4(QtGui.QMainWindow):
         self.ui.groupBoxGrid.setEnabled(True)
         self.ui.pushButtonStartScan.setEnabled(True)
         self.ui.pushButtonAbortScan.setEnabled(False)
+    def setGonioSetpoint(self, value):
+        self.ui.doubleSpinBoxGonioAngle.setValue(value)
+        self.ui.doubleSpinBoxGonioAngle_2.setValue(value)
     def setMoveOnClick(self,state):
         if(state): #checked
             self.raster.moveToBeam = True
@@ -1214,12 +1231,14 @@ class StartQT4(QtGui.QMainWindow):
     def autoFocusGonio(self):
         self.autofocus = AutoFocus(self.camera,DeviceProxy(self.focusDevice2),type=1)
         self.autofocus.start()
+        self.updateMountButton()
         self.connect(self.autofocus,SIGNAL("focusDone()"),self.focusDone)
         self.ui.pushButtonAutofocusGonio.setEnabled(False)
         self.ui.pushButtonAutofocusGonioZ.setEnabled(False)
     def autoFocusGonioZ(self):
         self.autofocus = AutoFocus(self.camera,DeviceProxy(self.focusDevice),type=0)
         self.autofocus.start()
+        self.updateMountButton()
         self.connect(self.autofocus,SIGNAL("focusDone()"),self.focusDone)
         self.ui.pushButtonAutofocusGonio.setEnabled(False)
         self.ui.pushButtonAutofocusGonioZ.setEnabled(False)
@@ -1227,11 +1246,11 @@ class StartQT4(QtGui.QMainWindow):
         self.ui.pushButtonAutofocusGonio.setEnabled(True)
         self.ui.pushButtonAutofocusGonioZ.setEnabled(True)
         if self.autofocus.type == 0:
-            self.ui.doubleSpinBoxGonioZposition.setValue(self.motorThread.proxyGonioZ.read_attribute("Position").w_value)
+            self.motorThread.submit("readSetpoint", ("GonioZ",), self.ui.doubleSpinBoxGonioZposition.setValue, CommandQueue.PRIORITY_HIGH)
         elif self.autofocus.type == 1:
-            self.ui.doubleSpinBoxGonioAngle.setValue(self.motorThread.proxyGonio.read_attribute("Position").w_value)
-            self.ui.doubleSpinBoxGonioAngle_2.setValue(self.motorThread.proxyGonio.read_attribute("Position").w_value)
+            self.motorThread.submit("readSetpoint", ("Gonio",), self.setGonioSetpoint, CommandQueue.PRIORITY_HIGH)
         self.autofocus = None
+        self.updateMountButton()
 if __name__ == '__main__':
     app = QtGui.QApplication(sys.argv)
     app.setStyle(QtGui.QStyleFactory.create("Cleanlooks"))
@@ -9,6 +9,8 @@ import numpy
 from PyTango import *
 from PIL import Image, ImageFilter, ImageChops, ImageStat, ImageDraw
 from PyQt4.QtGui import QImage
+from moveHandle import waitForMove
+from tangoStats import InstrumentedProxy
 
 class AutoFocus(QThread):
     # A thread is started by calling QThread.start() never by calling run() directly!
@@ -16,7 +18,7 @@ class AutoFocus(QThread):
         QThread.__init__(self)
         print "Autofocus thread: Starting thread"
         self.camera = camera
-        self.focusdevice = focusdevice
+        self.focusdevice = InstrumentedProxy(focusdevice)
         self.type=type
     def stop(self):
         print "Autofocus thread: Stopping thread"
@@ -42,9 +44,7 @@ class AutoFocus(QThread):
         contrastArray = numpy.zeros(len(positions))
         for i in range(len(positions)):
             self.focusdevice.write_attribute("Position",positions[i])
-            time.sleep(0.05)
-            while self.focusdevice.state() == DevState.MOVING:
-                time.sleep(0.01)
+            waitForMove(self.focusdevice, positions[i], tolerance=stepsize/4.0)
             #time.sleep(0.1)
             qimage = self.camera.getFrame()
             bytes=qimage.bits().asstring(qimage.numBytes())
@@ -62,9 +62,7 @@ class AutoFocus(QThread):
         
         print "Coarse scan found focus at", positions[maxContrast], ". Refining."
         self.focusdevice.write_attribute("Position",positions[maxContrast])
-        time.sleep(0.05)
-        while self.focusdevice.state() == DevState.MOVING:
-            time.sleep(0.01)
+        waitForMove(self.focusdevice, positions[maxContrast], tolerance=stepsize/4.0)
         if self.type == 0: #gonio Z
             startPos = positions[maxContrast]-100
             stopPos =  positions[maxContrast]+100
@@ -80,9 +78,7 @@ class AutoFocus(QThread):
         contrastArray = numpy.zeros(len(positions))
         for i in range(len(positions)):
             self.focusdevice.write_attribute("Position",positions[i])
-            time.sleep(0.05)
-            while self.focusdevice.state() == DevState.MOVING:
-                time.sleep(0.01)
+            waitForMove(self.focusdevice, positions[i], tolerance=stepsize/4.0)
             time.sleep(0.1)
             qimage = self.camera.getFrame()
             bytes=qimage.bits().asstring(qimage.numBytes())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Provides CommandQueue, a QThread that runs blocking device commands in the
+background, so the GUI thread never waits on a Tango call.
+Depends on PyQt4.
+
+"""
+
+import sys
+import threading
+import itertools
+import Queue
+from PyQt4.QtCore import SIGNAL, QThread
+
+
+class CommandQueue(QThread):
+    """Runs submitted commands one at a time in priority order, commands of equal
+    priority in the order they were submitted. Results are delivered to the
+    callbacks through the commandDone signal, i.e. in the thread that created the
+    queue. Stop commands bypass the queue: they run at once in their own thread,
+    even while another command hangs, and discard all commands still pending.
+    Immediate commands bypass the queue the same way but leave the pending
+    commands alone. Discarding emits cleared().
+
+    """
+
+    PRIORITY_IMMEDIATE = -1
+    PRIORITY_STOP = 0
+    PRIORITY_HIGH = 1
+    PRIORITY_NORMAL = 2
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.queue = Queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.alive = False
+        self.connect(self, SIGNAL("commandDone(PyQt_PyObject)"), self.deliver)
+
+    def submit(self, command, args=(), callback=None, priority=None):
+        """Queues a command and returns immediately.
+
+        Keyword arguments:
+        command -- callable to run
+        args -- tuple of arguments for the command (default ())
+        callback -- called with the result of the command, in the thread that created the queue (default None)
+        priority -- PRIORITY_IMMEDIATE, PRIORITY_STOP, PRIORITY_HIGH or PRIORITY_NORMAL (default PRIORITY_NORMAL)
+
+        """
+        if priority is None: priority = self.PRIORITY_NORMAL
+        if priority in (self.PRIORITY_IMMEDIATE, self.PRIORITY_STOP):
+            if priority == self.PRIORITY_STOP:
+                self.clear()
+            thread = threading.Thread(target=self.execute, args=(command, args, callback))
+            thread.daemon = True
+            thread.start()
+            return
+        with self.lock:
+            self.queue.put((priority, self.counter.next(), command, args, callback))
+
+    def clear(self):
+        # drops all pending commands, their callbacks are not called
+        with self.lock:
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+        self.emit(SIGNAL("cleared()"))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        self.alive = False
+        self.queue.put((self.PRIORITY_STOP, -1, None, (), None))
+        self.wait()
+
+    def run(self):
+        self.alive = True
+        while self.alive:
+            priority, number, command, args, callback = self.queue.get()
+            if command is None:
+                continue
+            self.execute(command, args, callback)
+
+    def execute(self, command, args, callback):
+        try:
+            result = command(*args)
+        except:
+            print "Command queue: command", getattr(command, "__name__", command), "failed:", sys.exc_info()[1]
+            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+            return
+        if callback is not None:
+            self.emit(SIGNAL("commandDone(PyQt_PyObject)"),(callback, result))
+
+    def deliver(self, done):
+        callback, result = done
+        callback(result)
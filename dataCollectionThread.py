@@ -12,6 +12,11 @@ import os
 import numpy
 #
 from scipy import ndimage
+from moveHandle import waitAll
+from scanJournal import ScanJournal
+from scanEstimator import ScanEstimator
+from rowPlanner import RowPlanner
+from scanTelemetry import ScanTelemetry
            
 class LCLScollector(QThread):
 
@@ -37,6 +42,30 @@ class LCLScollector(QThread):
         "", \
         "LCLS collection is already running.", \
     ]
+    
+    # scan modes: "sequential" uploads and runs one row after the other,
+    # "pipelined" renders the next row while the current one runs. It gives no measurable gain, rendering
+    # takes microseconds and all modes wait for the script start and predict the row end the same way,
+    # "parameterised" uploads scan.dmc once and only writes the row variables before each row,
+    # "chip" uploads and starts a single program for all rows, see chipScript
+    MODES = ("sequential", "pipelined", "parameterised", "chip")
+    # the chip mode needs a program defining #ROWSCAN, see chipScript
+    ROW_TEMPLATE = "chip.dmc"
+    CHIP_POLL_INTERVAL = 0.05       # seconds between progress polls in chip mode
+    DMC_LINE_LENGTH = 79            # maximum length of a generated program line
+    # rows hit by a beam dump are scanned again "immediate"ly, at the "end" of the scan or once the beam
+    # has been "stable" for stableTime seconds, at most maxRetries times each
+    RETRY_MODES = ("immediate", "end", "stable")
+    ETA_INTERVAL = 1.0              # seconds between etaUpdate signals while a row runs
+    START_TIMEOUT = 0.5             # seconds a started script may take to report running
+    START_POLL_INTERVAL = 0.01      # seconds between isScriptRunning polls until the script runs
+    # the end of a row is predicted from its length, see waitForScriptEnd
+    END_MARGIN = 0.1                # seconds before the predicted end the tight polling starts
+    END_POLL_INTERVAL = 0.002       # seconds between isScriptRunning polls near the end of a row
+    WATCHDOG_FACTOR = 2.0           # a row running longer than WATCHDOG_FACTOR times its prediction
+    WATCHDOG_MARGIN = 5.0           # plus WATCHDOG_MARGIN seconds stops the scan
+    MOVE_TIMEOUT = 60.0             # seconds the moves to a row start may take before the scan is stopped
+    MOVE_POLL_INTERVAL = 0.1        # seconds between checks for a stopped scan while the moves settle
 
     # A thread is started by calling QThread.start() never by calling run() directly!
     def __init__(self, motorThread, simulation = False):
@@ -57,6 +86,15 @@ class LCLScollector(QThread):
             "gonioStop": 0.0, \
             "startRow": 0.0, \
             "stopRow": 0.0, \
+            "mode": "sequential", \
+            "journal": None, \
+            "telemetry": None, \
+            "resume": False, \
+            "retryMode": "end", \
+            "maxRetries": 2, \
+            "stableTime": 10.0, \
+            "gonioSpeed": None, \
+            "planRows": True, \
         }
         self.conditionsList = { \
             "collectionStarted": False , \
@@ -67,6 +105,17 @@ class LCLScollector(QThread):
         self.currentRow = -1
         self.initialGonio = self.motorThread.currentGonio
         self.beamDumpOccurred =0
+        self.journal = None
+        self.estimator = None
+        self.directions = {}
+        self.planner = None
+        self.totalTime = 0.0
+        self.scanCompleted = False
+        self.telemetry = None
+        self.retries = {}
+        self.deferred = []
+        self.lastBeamDump = 0.0
+        self.lastEtaUpdate = 0.0
     
     def stop(self):
         print "LCLS collector thread: Stopping thread"
@@ -79,7 +128,16 @@ class LCLScollector(QThread):
         self.alive = False
 
     def run(self):
+        # the telemetry of a stopped scan is flushed as well
+        try:
+            self.collect()
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.close()
+
+    def collect(self):
         self.alive = True
+        self.scanCompleted = False
         self.starttime = time.time()
         print "LCLS collector thread: started"
         
@@ -88,70 +146,477 @@ class LCLScollector(QThread):
         f = open('scan.dmc', 'r')
         template = f.read()
         f.close()
+        rowTemplate = None
+        if self.parameters["mode"] == "chip":
+            # fail before anything moves or is journaled
+            if not os.path.isfile(self.ROW_TEMPLATE):
+                print "LCLS collector thread:", self.ROW_TEMPLATE, "not found, it is needed for", self.parameters["mode"], "mode"
+                self.emit(SIGNAL("logSignal(PyQt_PyObject)"), \
+                    "%s not found, it has to define #ROWSCAN for %s mode. Scan not started." % (self.ROW_TEMPLATE, self.parameters["mode"]))
+                self.alive = False
+                self.emit(SIGNAL("scanFinished()"))
+                return
+            f = open(self.ROW_TEMPLATE, 'r')
+            rowTemplate = f.read()
+            f.close()
         self.percentDone = 0.0
-        direction = -1
         
         rows = self.parameters["scanPoints"]
         rows = rows[self.parameters["startRow"]:self.parameters["stopRow"]]
-        self.currentRow = self.parameters["startRow"]
         
         self.initialGonio = self.motorThread.currentGonio
         gonioAngles = numpy.linspace(self.parameters["gonioStart"], self.parameters["gonioStop"], len(rows))
         
+        # rows completed by an interrupted run of the same scan are skipped when resuming
+        self.journal = None
+        completed = {}
+        if self.parameters["journal"]:
+            self.journal = ScanJournal(self.parameters["journal"])
+            if self.parameters["resume"]:
+                completed = self.journal.resumable(self.parameters, len(rows)) or {}
+                print "LCLS collector thread: resuming,", len(completed), "rows already done"
+            self.journal.begin(self.parameters, len(rows), bool(completed))
+        # one record per row with the time spent in each phase, see logRow
+        self.telemetry = ScanTelemetry(self.parameters["telemetry"])
+        pending = [i for i in range(len(rows)) if self.parameters["startRow"] + i not in completed]
+        # order and direction of the rows come from the planner, see rowStart. Rows the interrupted
+        # scan already scanned keep their journaled direction.
+        self.directions = {}
+        if completed:
+            for row, direction in self.journal.directions().items():
+                if 0 <= row - self.parameters["startRow"] < len(rows):
+                    self.directions[row - self.parameters["startRow"]] = direction
+        self.planner = None
+        if self.parameters["planRows"]:
+            self.planner = RowPlanner(rows, gonioAngles, gonioSpeed=self.parameters["gonioSpeed"])
+            pending = self.planRows(pending)
+        if not pending:
+            self.percentDone = 100.0
+            self.scanDone()
+            return
+        self.percentDone = 100.0 * (len(rows) - len(pending)) / len(rows)
+        
+        self.estimator = ScanEstimator(rows, self.parameters["freq"], self.parameters["acclPulses"], \
+                                       gonioAngles, self.parameters["gonioSpeed"])
+        self.totalTime = self.estimator.scanTime(pending)
+        print "LCLS collector thread: predicted scan time %.0f s" % self.totalTime
+        # rows hit by a beam dump are scanned again, see retryRow
+        self.retries = {}
+        self.deferred = []
+        self.lastBeamDump = 0.0
+        self.lastEtaUpdate = 0.0
+        self.updateEta(pending)
+        
+        if self.parameters["mode"] == "chip":
+            # the program cannot take rows while it runs, so retries always follow as a new program
+            while pending:
+                if not self.runChip(self.chipScript(rowTemplate, rows, pending), rows, gonioAngles, pending):
+                    return
+                pending = self.takeRetries(False)
+            self.percentDone = 100.0
+            self.scanDone()
+            return
         
-        for row in rows:
+        parameterised = self.parameters["mode"] == "parameterised"
+        pipelined = self.parameters["mode"] == "pipelined"
+        script = None
+        if parameterised:
+            # the program is uploaded once, each row only sets its variables
+            self.motorThread.uploadScript(self.parameterisedScript(template))
+        else:
+            # in pipelined mode the script of the next row is rendered while the current row runs
+            script = self.timedScript(template, rows, pending[0])
+        while pending:
+            i = pending.pop(0)
             if not self.alive:
                 self.percentDone = 0.0
                 self.emit(SIGNAL("scanFinished()"))
                 return
-            num = len(row)
-            self.currentRow += 1
+            self.currentRow = self.parameters["startRow"] + i
             print "currentRow is now",self.currentRow
-            self.motorThread.setGonio(gonioAngles[self.currentRow])
-            time.sleep(0.1)
-            while self.motorThread.stateProxyGonio == DevState.MOVING:
-                time.sleep(0.1)
-            direction *= -1
-            if(direction > 0):
-                startX = row[0].x()
-                startY = row[0].y()
-            elif(direction < 0):
-                startX = row[-1].x()
-                startY = row[-1].y()
-            else:
+            rowStartTime = time.time()
+            self.estimator.startRow(i)
+            # the gonio rotation and the stage move to the row start run at the same time
+            start, direction = self.rowStart(rows, i)
+            moved = self.waitForMoves([self.motorThread.setGonio(gonioAngles[i]), \
+                                       self.motorThread.setScanX(start.x()), \
+                                       self.motorThread.setScanY(start.y())])
+            if not moved:
+                self.movesNotSettled(moved, self.currentRow)
                 return
-            
-            script = template.format( \
-                startX=startX, \
-                startY=startY, \
-                angle=self.parameters["angle"], \
-                num=num, \
-                dir=direction, \
-                freq=self.parameters["freq"], \
-                pulses=self.parameters["acclPulses"], \
-            )
-            self.motorThread.uploadScript(script)
+            timing = {"move": time.time() - rowStartTime}
+            startPositions = self.polledPositions()
+            if parameterised:
+                t = time.time()
+                variables = self.rowVariables(rows, i)
+                timing["format"] = time.time() - t
+                t = time.time()
+                self.motorThread.writeVariables(variables)
+            else:
+                if script is None or script[0] != i:
+                    script = self.timedScript(template, rows, i)
+                timing["format"] = script[2]
+                t = time.time()
+                self.motorThread.uploadScript(script[1])
+            timing["upload"] = time.time() - t
+            t = time.time()
             self.motorThread.startScript("SCAN")
-            time.sleep(0.5)
+            scriptStart = time.time()
+            script = None
+            started = self.waitForScriptStart()
+            timing["start"] = time.time() - t
+            if not started:
+                # the row is not journaled, a resume scans it again
+                self.scriptNotStarted()
+                return
+            if pipelined and pending:
+                script = self.timedScript(template, rows, pending[0])
             self.emit(SIGNAL("scanUpdate()"))
-            while(self.motorThread.isScriptRunning()):
-                if not self.alive:
-                    self.percentDone = 0.0
-                    self.emit(SIGNAL("scanFinished()"))
-                    return
-                time.sleep(0.25)
+            finished = self.waitForScriptEnd(scriptStart, self.estimator.scanDuration(i), pending)
+            timing["run"] = time.time() - scriptStart
+            if not finished:
+                if finished is not None:
+                    print "LCLS collector thread: row", self.currentRow, "did not finish in time, scan stopped"
+                    self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Row %d did not finish in time, scan stopped." % self.currentRow)
+                    self.alive = False
+                self.percentDone = 0.0
+                self.emit(SIGNAL("scanFinished()"))
+                return
+            self.estimator.finishRow(i)
             self.percentDone += 100.0 / len(rows)
             self.beamDumpOccurred = self.motorThread.checkBeamDump()
+            self.recordRow(rows, i, gonioAngles[i], rowStartTime)
+            self.logRow(i, direction, gonioAngles[i], rowStartTime, timing, startPositions)
+            if self.beamDumpOccurred and self.retryRow(i):
+                self.percentDone -= 100.0 / len(rows)
+                if self.parameters["retryMode"] == "immediate":
+                    pending[0:0] = self.takeRetries(True)
+            elif self.parameters["retryMode"] == "stable" and self.beamStable():
+                pending[0:0] = self.takeRetries(True)
+            if not pending:
+                pending = self.takeRetries(False)
+            self.updateEta(pending)
             self.emit(SIGNAL("lineFinished()"))
             self.emit(SIGNAL("scanUpdate()"))
 
         #stop data collection
+        self.scanDone()
+
+    def scanDone(self):
+        if self.journal is not None:
+            self.journal.finish()
+        self.scanCompleted = True
+        if self.telemetry is not None and self.telemetry.records:
+            summary = self.telemetry.summaryText()
+            print "LCLS collector thread: row timing\n" + summary
+            self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Row timing: " + summary)
         self.dataCollectionActive = False
         self.emit(SIGNAL("scanFinished()"))
         print "LCLS collector thread: Thread for LCLS collector died"
         self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"LCLS collection finished.")
         self.alive = False
 
+    def updateEta(self, pending):
+        # publishes the predicted time left, pending are the rows not started yet
+        self.remainingTime = self.estimator.remaining(list(pending) + self.deferred)
+        self.lastEtaUpdate = time.time()
+        percent = self.percentDone + 100.0 * self.estimator.rowFraction() / self.estimator.rowCount
+        self.emit(SIGNAL("etaUpdate(PyQt_PyObject)"), { \
+            "remaining": self.remainingTime, \
+            "eta": self.lastEtaUpdate + self.remainingTime, \
+            "total": self.totalTime, \
+            "percent": min(percent, 100.0), \
+        })
+
+    def retryRow(self, i):
+        # queues row i for another scan unless it ran out of retries, returns True if it was queued
+        self.lastBeamDump = time.time()
+        if self.retries.get(i, 0) >= self.parameters["maxRetries"]:
+            print "LCLS collector thread: row", self.parameters["startRow"] + i, "hit by a beam dump, no retries left"
+            return False
+        self.retries[i] = self.retries.get(i, 0) + 1
+        self.deferred.append(i)
+        print "LCLS collector thread: row", self.parameters["startRow"] + i, "hit by a beam dump, retry", self.retries[i]
+        return True
+
+    def beamStable(self):
+        return time.time() - self.lastBeamDump >= self.parameters["stableTime"]
+
+    def takeRetries(self, now):
+        # returns the queued retries and empties the queue. Called when no other rows are left (now False),
+        # "stable" mode first waits until the beam has been stable for stableTime.
+        if not self.deferred:
+            return []
+        if not now and self.parameters["retryMode"] == "stable":
+            while self.alive and not self.beamStable():
+                time.sleep(0.1)
+        retries = self.deferred
+        self.deferred = []
+        return self.planRows(retries)
+
+    def planRows(self, indices):
+        # orders the rows to scan next, starting from where the stage and the gonio are now. Rows that
+        # already have a direction, i.e. retries and rows journaled before a resume, keep it.
+        if self.planner is None:
+            return indices
+        fixed = dict([(i, self.directions[i]) for i in indices if i in self.directions])
+        plan = self.planner.plan(indices, (self.motorThread.currentScanX, self.motorThread.currentScanY), \
+                                 self.motorThread.currentGonio, fixed)
+        self.directions.update(dict(plan))
+        return [i for i, direction in plan]
+
+    def recordRow(self, rows, i, gonio, startTime):
+        # journals row i as completed, together with the beam dump flag of its last check
+        if self.journal is None:
+            return
+        start, direction = self.rowStart(rows, i)
+        self.journal.rowDone(self.parameters["startRow"] + i, direction, gonio, self.beamDumpOccurred, startTime)
+
+    def logRow(self, i, direction, gonio, startTime, timing, startPositions=None):
+        # hands the telemetry record of row i to the background writer
+        record = dict(timing)
+        record.update({"row": self.parameters["startRow"] + i, "direction": direction, "gonio": float(gonio), \
+                       "beamDump": bool(self.beamDumpOccurred), "startTime": startTime, "total": time.time() - startTime, \
+                       "startPositions": startPositions, "endPositions": self.polledPositions()})
+        self.telemetry.record(record)
+
+    def polledPositions(self):
+        return {"ScanX": self.motorThread.currentScanX, "ScanY": self.motorThread.currentScanY, \
+                "Gonio": self.motorThread.currentGonio}
+
+    def runChip(self, script, rows, gonioAngles, pending):
+        # runs the given rows as one program, returns False if the scan was stopped. The program asks for each gonio angle by setting gonReq
+        # to the row number and waits until gonAck matches, progress is read from rowDone.
+        # Program row k is row pending[k] of rows.
+        rowStartTimes = {}
+        moveTimes = {}
+        self.motorThread.uploadScript(script)
+        self.motorThread.startScript("SCAN")
+        if not self.waitForScriptStart():
+            # rowDone may still hold the count of an earlier program, nothing is booked
+            self.scriptNotStarted()
+            return False
+        self.emit(SIGNAL("scanUpdate()"))
+        acknowledged = -1
+        rowsDone = 0
+        while self.motorThread.isScriptRunning():
+            if not self.alive:
+                # the program ends after the current row, or at once while it waits for the gonio
+                self.motorThread.writeVariable("abort", 1)
+                self.percentDone = 0.0
+                self.emit(SIGNAL("scanFinished()"))
+                return False
+            gonioRequest = self.motorThread.readVariable("gonReq")
+            if gonioRequest is not None and int(gonioRequest) > acknowledged:
+                acknowledged = int(gonioRequest)
+                rowStartTimes[acknowledged] = time.time()
+                self.estimator.startRow(pending[acknowledged])
+                moved = self.waitForMoves([self.motorThread.setGonio(gonioAngles[pending[acknowledged]])])
+                if not moved:
+                    self.motorThread.writeVariable("abort", 1)
+                    self.movesNotSettled(moved, self.parameters["startRow"] + pending[acknowledged])
+                    return False
+                moveTimes[acknowledged] = time.time() - rowStartTimes[acknowledged]
+                self.motorThread.writeVariable("gonAck", acknowledged)
+            rowsDone = self.chipRowsDone(rowsDone, rows, gonioAngles, pending, rowStartTimes, moveTimes)
+            if time.time() - self.lastEtaUpdate >= self.ETA_INTERVAL:
+                self.updateEta(pending[acknowledged + 1:])
+            time.sleep(self.CHIP_POLL_INTERVAL)
+        # rows finished after the last poll
+        self.chipRowsDone(rowsDone, rows, gonioAngles, pending, rowStartTimes, moveTimes)
+        return True
+
+    def chipRowsDone(self, rowsDone, rows, gonioAngles, pending, rowStartTimes, moveTimes):
+        # reads rowDone of the chip program and books the rows finished since rowsDone, returns the new count
+        done = self.motorThread.readVariable("rowDone")
+        if done is None or int(done) <= rowsDone:
+            return rowsDone
+        self.beamDumpOccurred = self.motorThread.checkBeamDump()
+        # the beam dump flag covers all rows finished since the last poll
+        for k in range(rowsDone, int(done)):
+            self.recordRow(rows, pending[k], gonioAngles[pending[k]], rowStartTimes.get(k, time.time()))
+            if k in rowStartTimes:
+                self.estimator.finishRow(pending[k], time.time() - rowStartTimes[k])
+                # the program moves the stage and runs the row itself, only the gonio step is timed here
+                self.logRow(pending[k], self.rowStart(rows, pending[k])[1], gonioAngles[pending[k]], \
+                            rowStartTimes[k], {"move": moveTimes.get(k)})
+            if not (self.beamDumpOccurred and self.retryRow(pending[k])):
+                self.percentDone += 100.0 / len(rows)
+        rowsDone = int(done)
+        self.currentRow = self.parameters["startRow"] + pending[rowsDone - 1]
+        self.emit(SIGNAL("lineFinished()"))
+        self.emit(SIGNAL("scanUpdate()"))
+        return rowsDone
+
+    def chipScript(self, rowTemplate, rows, indices=None):
+        """Renders a single program scanning all rows.
+        
+        The row scan itself comes from ROW_TEMPLATE (chip.dmc), which has to define the subroutine #ROWSCAN
+        ending with EN. The file is not shipped, it has to be written for the controller setup.
+        #ROWSCAN is called once per row with the row parameters in the program variables
+        startX, startY, num and dir and the scan parameters in angle, freq and pulses,
+        i.e. the values scan.dmc gets through its placeholders.
+        
+        Keyword arguments:
+        rowTemplate -- program text defining #ROWSCAN
+        rows -- list of rows, each a list of points
+        indices -- indices of the rows to scan, in scan order (default None, all rows)
+        
+        Return value:
+        program text
+        
+        """
+        if indices is None: indices = range(len(rows))
+        n = len(indices)
+        rowX = []
+        rowY = []
+        rowDir = []
+        for i in indices:
+            start, direction = self.rowStart(rows, i)
+            rowDir.append(direction)
+            rowX.append(start.x())
+            rowY.append(start.y())
+        lines = ["#SCAN", "DM rowX[%d],rowY[%d],rowNum[%d],rowDir[%d]" % (n, n, n, n)]
+        lines += self.dmcAssignments("rowX", rowX)
+        lines += self.dmcAssignments("rowY", rowY)
+        lines += self.dmcAssignments("rowNum", [len(rows[i]) for i in indices])
+        lines += self.dmcAssignments("rowDir", rowDir)
+        lines += [ \
+            "angle=%.4f;freq=%.4f;pulses=%d" % (self.parameters["angle"], self.parameters["freq"], self.parameters["acclPulses"]), \
+            "rowDone=0;gonReq=-1;gonAck=-1;abort=0;row=0", \
+            "#ROW", \
+            "gonReq=row", \
+            "#GWAIT", \
+            "JP #GWAIT,(gonAck<row)&(abort=0)", \
+            "JP #DONE,abort=1", \
+            "startX=rowX[row];startY=rowY[row];num=rowNum[row];dir=rowDir[row]", \
+            "JS #ROWSCAN", \
+            "row=row+1;rowDone=row", \
+            "JP #DONE,abort=1", \
+            "JP #ROW,row<%d" % n, \
+            "#DONE", \
+            "EN", \
+        ]
+        return "\n".join(lines) + "\n" + rowTemplate
+
+    def dmcAssignments(self, name, values):
+        # array assignments packed into as few program lines as possible, the controller takes 4 decimals
+        lines = []
+        line = ""
+        for i in range(len(values)):
+            assignment = "%s[%d]=%.4f" % (name, i, values[i])
+            if line and len(line) + 1 + len(assignment) > self.DMC_LINE_LENGTH:
+                lines.append(line)
+                line = ""
+            if line:
+                line += ";"
+            line += assignment
+        if line:
+            lines.append(line)
+        return lines
+
+    def parameterisedScript(self, template):
+        # scan.dmc with the row placeholders replaced by the program variables that rowVariables sets
+        return template.format( \
+            startX="startX", \
+            startY="startY", \
+            angle=self.parameters["angle"], \
+            num="num", \
+            dir="dir", \
+            freq=self.parameters["freq"], \
+            pulses=self.parameters["acclPulses"], \
+        )
+
+    def rowVariables(self, rows, i):
+        # program variables of row i for parameterisedScript
+        start, direction = self.rowStart(rows, i)
+        return [("startX", "%.4f" % start.x()), ("startY", "%.4f" % start.y()), ("num", len(rows[i])), ("dir", direction)]
+
+    def rowStart(self, rows, i):
+        # returns (start point, direction) of row i. Unplanned rows are scanned in alternating
+        # directions starting with the first point.
+        direction = self.directions.get(i, 1 - 2 * (i % 2))
+        if direction > 0:
+            return rows[i][0], 1
+        return rows[i][-1], -1
+
+    def timedScript(self, template, rows, i):
+        # returns (i, script of row i, seconds it took to render)
+        t = time.time()
+        script = self.rowScript(template, rows, i)
+        return (i, script, time.time() - t)
+
+    def rowScript(self, template, rows, i):
+        # the scan program of row i
+        start, direction = self.rowStart(rows, i)
+        return template.format( \
+            startX=start.x(), \
+            startY=start.y(), \
+            angle=self.parameters["angle"], \
+            num=len(rows[i]), \
+            dir=direction, \
+            freq=self.parameters["freq"], \
+            pulses=self.parameters["acclPulses"], \
+        )
+
+    def scriptNotStarted(self):
+        # ends the scan after the controller did not report the started script running
+        if self.alive:
+            print "LCLS collector thread: scan script did not start, scan stopped"
+            self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Scan script did not start, scan stopped.")
+            self.alive = False
+        self.percentDone = 0.0
+        self.emit(SIGNAL("scanFinished()"))
+
+    def waitForMoves(self, handles):
+        # returns True when all moves have settled, False when MOVE_TIMEOUT expired and None when the scan was stopped
+        deadline = time.time() + self.MOVE_TIMEOUT
+        while not waitAll(handles, self.MOVE_POLL_INTERVAL):
+            if not self.alive:
+                return None
+            if time.time() > deadline:
+                return False
+        return True
+
+    def movesNotSettled(self, moved, row):
+        # ends the scan after waitForMoves returned False or None for the moves to the given row
+        if moved is not None:
+            print "LCLS collector thread: moves to row", row, "did not settle in time, scan stopped"
+            self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Moves to row %d did not settle in time, scan stopped." % row)
+            self.alive = False
+        self.percentDone = 0.0
+        self.emit(SIGNAL("scanFinished()"))
+
+    def waitForScriptStart(self):
+        # replaces the fixed 0.5 s sleep: returns as soon as the controller reports the task running
+        deadline = time.time() + self.START_TIMEOUT
+        while time.time() < deadline and self.alive:
+            if self.motorThread.isScriptRunning():
+                return True
+            time.sleep(self.START_POLL_INTERVAL)
+        return False
+
+    def waitForScriptEnd(self, start, duration, pending):
+        # sleeps until shortly before the predicted end of the row, then polls tightly. Returns True when
+        # the script has ended, False when the watchdog expired and None when the scan was stopped.
+        wake = start + duration - self.END_MARGIN
+        watchdog = start + self.WATCHDOG_FACTOR * duration + self.WATCHDOG_MARGIN
+        while time.time() < wake:
+            if not self.alive:
+                return None
+            if time.time() - self.lastEtaUpdate >= self.ETA_INTERVAL:
+                self.updateEta(pending)
+            time.sleep(max(min(wake - time.time(), 0.1), 0.0))
+        while self.motorThread.isScriptRunning():
+            if not self.alive:
+                return None
+            if time.time() > watchdog:
+                return False
+            if time.time() - self.lastEtaUpdate >= self.ETA_INTERVAL:
+                self.updateEta(pending)
+            time.sleep(self.END_POLL_INTERVAL)
+        return True
+
     def setParameters(self, data):
         if(type(data) != dict):
             return self.ERR_TYPE_MISMATCH
@@ -1,5 +1,6 @@
 from PyTango import *
 import time
+from moveHandle import waitForMove
 print "Homing onaxis x"
 con1 = DeviceProxy("p11/galildmc/eh.04")
 con1.command_inout("WriteRead","SDC=2000000")
@@ -7,17 +8,13 @@ dev = DeviceProxy("p11/motor/eh.t2.03")
 if dev.state() == DevState.OFF: dev.command_inout("Enable")
 dev.write_attribute("SoftLimitEnable",False)
 dev.write_attribute("Position",100000)
-time.sleep(0.5)
-while dev.state() == DevState.MOVING:
-    time.sleep(0.1)
+waitForMove(dev, 100000)
 print "CCW limit reached. Calibrating."
 time.sleep(0.5)
 dev.command_inout("Calibrate",8027)
 print "Moving to 0"
 dev.write_attribute("Position",0)
-time.sleep(0.1)
-while dev.state() == DevState.MOVING:
-    time.sleep(0.1)
+waitForMove(dev, 0)
 print "Enabling soft limits"
 dev.write_attribute("SoftLimitEnable",True)
 print "Onaxis X done"
\ No newline at end of file
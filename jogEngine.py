@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Provides JogEngine, which turns jog button clicks and presses into as few
+motor moves as possible.
+Depends on PyQt4.
+
+"""
+
+from PyQt4.QtCore import QObject, QTimer, SIGNAL
+from commandQueue import CommandQueue
+
+
+class JogEngine(QObject):
+    """Steps are added to the last commanded target of an axis, not to its polled
+    position, so fast clicks add up instead of fighting each other. Steps that
+    arrive within COALESCE_INTERVAL are sent as a single move. Holding a button
+    longer than HOLD_DELAY drives the axis towards its travel limit at its
+    configured velocity until the button is released. All targets are
+    forgotten when the command queue discards its pending commands, i.e. on
+    every stop, because the dropped moves never report back.
+
+    """
+
+    COALESCE_INTERVAL = 50  # ms steps are collected before a move is sent
+    HOLD_DELAY = 400        # ms a button has to be held for continuous motion
+    # MotorThread attributes holding the travel limits of the axes that support continuous motion
+    LIMITS = {"ScanX": ("scanXMin", "scanXMax"), "ScanY": ("scanYMin", "scanYMax")}
+
+    def __init__(self, motorThread):
+        """Keyword arguments:
+        motorThread -- running MotorThread, moves are sent through its command queue
+
+        """
+        QObject.__init__(self)
+        self.motorThread = motorThread
+        self.targets = {}           # last target per axis, sent or about to be sent
+        self.handles = {}           # MoveHandle of the last move per axis, None while it is being sent
+        self.flushPending = set()
+        self.holdTimers = {}
+        self.continuous = set()
+        self.connect(motorThread.commandQueue, SIGNAL("cleared()"), self.forgetAll)
+
+    def jog(self, axis, step):
+        """Moves an axis by step relative to its last target.
+
+        """
+        self.targets[axis] = self.base(axis) + step
+        if axis not in self.flushPending:
+            self.flushPending.add(axis)
+            QTimer.singleShot(self.COALESCE_INTERVAL, lambda: self.flush(axis))
+
+    def press(self, axis, step):
+        """Jogs one step and starts continuous motion if the button is still held after HOLD_DELAY.
+
+        """
+        self.jog(axis, step)
+        if axis not in self.LIMITS:
+            return
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        self.connect(timer, SIGNAL("timeout()"), lambda: self.startContinuous(axis, step))
+        timer.start(self.HOLD_DELAY)
+        self.holdTimers[axis] = timer
+
+    def release(self, axis):
+        """Ends a press, stops the axis if it was moving continuously.
+
+        """
+        timer = self.holdTimers.pop(axis, None)
+        if timer is not None:
+            timer.stop()
+        if axis in self.continuous:
+            self.continuous.discard(axis)
+            self.forget(axis)
+            # bypasses the queue without discarding the commands of other axes
+            self.motorThread.submit("stopAxis", (axis,), priority=CommandQueue.PRIORITY_IMMEDIATE)
+
+    def base(self, axis):
+        # the last target while a move is on its way, the polled position once the axis settled
+        if axis in self.targets:
+            handle = self.handles.get(axis)
+            if handle is None or not handle.done():
+                return self.targets[axis]
+        return getattr(self.motorThread, "current" + axis)
+
+    def flush(self, axis):
+        self.flushPending.discard(axis)
+        if axis not in self.targets:
+            return
+        target = self.targets[axis]
+        self.handles[axis] = None
+        self.motorThread.submit("set" + axis, (target,), lambda handle: self.moveSent(axis, target, handle))
+
+    def moveSent(self, axis, target, handle):
+        if self.targets.get(axis) != target:
+            # a newer move has been sent or the axis was stopped
+            return
+        if handle.error is not None:
+            self.forget(axis)
+        else:
+            self.handles[axis] = handle
+
+    def startContinuous(self, axis, step):
+        self.holdTimers.pop(axis, None)
+        self.continuous.add(axis)
+        self.forget(axis)
+        minimum, maximum = [getattr(self.motorThread, name) for name in self.LIMITS[axis]]
+        if step > 0:
+            limit = maximum
+        else:
+            limit = minimum
+        self.motorThread.submit("set" + axis, (limit,), lambda handle: self.continuousSent(axis))
+
+    def continuousSent(self, axis):
+        # the stop on release overtook the queued move to the limit, stop the axis again once it was sent
+        if axis not in self.continuous:
+            self.motorThread.submit("stopAxis", (axis,), priority=CommandQueue.PRIORITY_IMMEDIATE)
+
+    def forget(self, axis):
+        # the next jog starts from the polled position again
+        self.targets.pop(axis, None)
+        self.handles.pop(axis, None)
+        self.flushPending.discard(axis)
+
+    def forgetAll(self):
+        for axis in list(self.targets):
+            self.forget(axis)
@@ -17,6 +17,106 @@ from PyQt4.QtGui import QImage, QTransform
 import httplib
 import json
 import math
+import time
+import socket
+import threading
+
+class ConnectionPool():
+    """Keeps HTTP connections to each host and port open between requests, so
+    control calls do not pay a TCP connection setup each. At most
+    MAX_CONNECTIONS requests per host and port are in flight at the same time,
+    further requests wait for a free connection. A connection the server has
+    closed in the meantime is replaced by a new one and the request is sent again,
+    but only if the server cannot have seen the request: when sending failed or
+    the server closed the connection without answering a single byte. A timeout
+    is never retried, the camera may already have run the command.
+    
+    """
+
+    MAX_CONNECTIONS = 2
+    TIMEOUT = 3
+
+    def __init__(self, maxConnections=None):
+        """Keyword arguments:
+        maxConnections -- maximum number of connections per host and port (default MAX_CONNECTIONS)
+        
+        """
+        if(maxConnections is None): maxConnections = self.MAX_CONNECTIONS
+        self.maxConnections = maxConnections
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.idle = {}
+
+    def get(self, host, port, url):
+        """Sends a HTTP GET request and reads the whole answer.
+        
+        Keyword arguments:
+        host -- IP or hostname
+        port -- TCP port number
+        url -- requested path and query
+        
+        Return value:
+        tuple (status, reason, content), raises an exception if the server cannot be reached
+        
+        """
+        key = (host, int(port))
+        with self.lock:
+            if(key not in self.slots):
+                self.slots[key] = threading.BoundedSemaphore(self.maxConnections)
+                self.idle[key] = []
+            slots = self.slots[key]
+        slots.acquire()
+        try:
+            while(True):
+                http, reused = self.take(key)
+                try:
+                    http.request("GET", url)
+                except socket.timeout:
+                    http.close()
+                    raise
+                except (httplib.HTTPException, socket.error):
+                    http.close()
+                    # the server closed the idle connection, the request did not get out
+                    if(reused): continue
+                    raise
+                try:
+                    response = http.getresponse()
+                    data = response.read()
+                except httplib.BadStatusLine as error:
+                    http.close()
+                    # closed without a byte of answer, the server dropped the idle connection unread.
+                    # httplib reports this as an empty line, newer 2.7 releases with a message
+                    if(reused and (not error.line or "No status line received" in error.line)): continue
+                    raise
+                except:
+                    http.close()
+                    raise
+                if(response.will_close):
+                    http.close()
+                else:
+                    with self.lock:
+                        self.idle[key].append(http)
+                return (response.status, response.reason, data)
+        finally:
+            slots.release()
+
+    def take(self, key):
+        # returns (connection, True if it was used before)
+        with self.lock:
+            if(self.idle[key]):
+                return (self.idle[key].pop(), True)
+        return (httplib.HTTPConnection(key[0], key[1], timeout=self.TIMEOUT), False)
+
+    def close(self):
+        """Closes all idle connections.
+        
+        """
+        with self.lock:
+            for connections in self.idle.values():
+                for http in connections:
+                    http.close()
+                del connections[:]
+
 
 class MjpgStream(QThread):
     """Provides constants and methods to communicate with mjpg-streamer
@@ -226,7 +326,12 @@ class MjpgStream(QThread):
     IN_CMD_AVT_WHITEBAL_VALUE_RED = (1, IN_CMD_GROUP_AVT_WHITE_BALANCE)
     IN_CMD_AVT_WIDTH = (5, IN_CMD_GROUP_AVT_IMAGE_FORMAT)
 
-    def __init__(self, host, port, path="/", plugin=0):
+    # seconds to wait before the stream is opened again after it broke
+    STREAM_RECONNECT_DELAY = 1.0
+    # seconds the cached values of a command group are used before they are read from the camera again
+    CONTROLS_TTL = 0.5
+
+    def __init__(self, host, port, path="/", plugin=0, streaming=True):
         """Initializes the basic settings.
         
         Keyword arguments:
@@ -234,6 +339,8 @@ class MjpgStream(QThread):
         port -- TCP port number mjpg-streamer listens on
         path -- HTTP server path (default "/")
         plugin -- number of the input_avt.so plugin (default 0)
+        streaming -- receive frames from one ?action=stream connection instead of
+                     requesting every frame with ?action=snapshot (default True)
         
         """
         QThread.__init__(self)
@@ -249,6 +356,11 @@ class MjpgStream(QThread):
         self.plugin = int(plugin)
         self.frame = None
         self.raw = None;
+        self.streaming = streaming
+        self.pool = ConnectionPool()
+        self.controls = {}          # (plugin, dest) -> {(group, id): command info}
+        self.controlsTime = {}      # (plugin, dest, group) -> time the values of the group were read
+        self.controlsLock = threading.Lock()
         self.updateControls = None
         self.updateControls = self.hasUpdateControls()
         self.inputAvt = self.isInputAvt()
@@ -256,6 +368,8 @@ class MjpgStream(QThread):
     def run(self):
         """Main method of a thread to receive the MJEPG-stream.
         For every frame received, the SIGNAL newFrame() is thrown.
+        Frames are read from one ?action=stream connection, which is opened again
+        when it breaks, or requested one by one if streaming is off.
         Never call this directly. Always use start().
         
         """
@@ -263,32 +377,46 @@ class MjpgStream(QThread):
         self.inputAvt = self.isInputAvt()
         self.running = True
         while(self.running):
-            frame = self.httpGet("?action=snapshot")
-            if(frame):
-                self.raw = frame
-                frame = QImage.fromData(frame)
-                oldWidth = frame.size().width()
-                oldHeight = frame.size().height()
-                if self.rotation is not None:
-                    #print "rot"
-                    #print "before", frame.size().width(),frame.size().height()
-                    transf = QTransform()
-                    transf.rotate(self.rotation)
-                    frame = frame.transformed(transf)
-                    #print "after", frame.size().width(),frame.size().height()
-                    newWidth = frame.size().width()
-                    newHeight = frame.size().height()
-                    
-                    addedHeight = oldWidth*math.sin(math.radians(self.rotation)) 
-                    addedWidth = oldHeight*math.sin(math.radians(self.rotation))
-                    
-                    h=oldHeight/math.sin(math.radians(self.rotation))
-                    #l1 = 
-                    #print "addedwidth,Height",addedWidth,addedHeight
-                if(self.transformMode is not None and not (self.width == frame.width() and self.height == frame.height())):
-                    frame = frame.scaled(self.width, self.height, self.aspectRatio, self.transformMode)
-                self.frame = frame
-                self.emit(SIGNAL("newFrame()"))
+            if(self.streaming):
+                for frame in self.streamFrames():
+                    self.processFrame(frame)
+                    if(not self.running): break
+                if(self.running): time.sleep(self.STREAM_RECONNECT_DELAY)
+            else:
+                self.processFrame(self.httpGet("?action=snapshot"))
+
+    def processFrame(self, frame):
+        """Decodes and scales a received JPEG frame and throws the SIGNAL newFrame().
+        
+        Keyword arguments:
+        frame -- JPEG data as string, ignored if empty or None
+        
+        """
+        if(frame):
+            self.raw = frame
+            frame = QImage.fromData(frame)
+            oldWidth = frame.size().width()
+            oldHeight = frame.size().height()
+            if self.rotation is not None:
+                #print "rot"
+                #print "before", frame.size().width(),frame.size().height()
+                transf = QTransform()
+                transf.rotate(self.rotation)
+                frame = frame.transformed(transf)
+                #print "after", frame.size().width(),frame.size().height()
+                newWidth = frame.size().width()
+                newHeight = frame.size().height()
+                
+                addedHeight = oldWidth*math.sin(math.radians(self.rotation)) 
+                addedWidth = oldHeight*math.sin(math.radians(self.rotation))
+                
+                h=oldHeight/math.sin(math.radians(self.rotation))
+                #l1 = 
+                #print "addedwidth,Height",addedWidth,addedHeight
+            if(self.transformMode is not None and not (self.width == frame.width() and self.height == frame.height())):
+                frame = frame.scaled(self.width, self.height, self.aspectRatio, self.transformMode)
+            self.frame = frame
+            self.emit(SIGNAL("newFrame()"))
 
     def stop(self):
         """Stops the streaming thread.
@@ -296,6 +424,73 @@ class MjpgStream(QThread):
         """
         self.running = False
         self.wait() # waits until run stops on its own  
+        self.pool.close()
+
+    def streamFrames(self):
+        """Opens ?action=stream once and yields the frames of the multipart/x-mixed-replace
+        answer as they arrive. Ends when the connection breaks or times out.
+        
+        Return value:
+        generator of JPEG data as strings
+        
+        """
+        http = httplib.HTTPConnection(self.host, self.port, timeout=3)
+        try:
+            http.request("GET", self.path+"?action=stream")
+            # buffered socket file, unbuffered every readline below costs one recv per byte
+            response = http.getresponse(buffering=True)
+            if response.status != 200:
+                print response.status, response.reason
+                return
+            contentType = response.getheader("content-type", "")
+            boundary = None
+            for parameter in contentType.split(";")[1:]:
+                key, sep, value = parameter.strip().partition("=")
+                if(key.lower() == "boundary"):
+                    boundary = "--" + value.strip('"')
+            if(not contentType.startswith("multipart/x-mixed-replace") or boundary is None or response.chunked):
+                print "No MJPEG stream at http://{0}:{1}{2}?action=stream, falling back to snapshots".format(self.host, self.port, self.path)
+                self.streaming = False
+                return
+            stream = response.fp
+            atBoundary = False
+            while(self.running):
+                # skip to the next part, then read its headers up to the empty line
+                if(not atBoundary):
+                    line = stream.readline()
+                    if(not line): return
+                    if(not line.startswith(boundary)): continue
+                atBoundary = False
+                length = None
+                while(True):
+                    line = stream.readline()
+                    if(not line): return
+                    line = line.strip()
+                    if(not line): break
+                    key, sep, value = line.partition(":")
+                    if(key.lower() == "content-length"):
+                        length = int(value)
+                if(length is not None):
+                    frame = stream.read(length)
+                    if(len(frame) < length): return
+                else:
+                    # no length given, the frame ends where the next boundary starts
+                    parts = []
+                    while(True):
+                        line = stream.readline()
+                        if(not line): return
+                        if(line.startswith(boundary)):
+                            atBoundary = True
+                            break
+                        parts.append(line)
+                    frame = "".join(parts)
+                    if(frame.endswith("\r\n")): frame = frame[:-2]
+                yield frame
+        except Exception:
+            # not a bare except, closing the generator raises GeneratorExit here
+            print "Stream from http://{0}:{1}{2}?action=stream interrupted".format(self.host, self.port, self.path)
+        finally:
+            http.close()
 
     def httpGet(self, query, host=None, port=None, path=None):
         """Sends HTTP GET requests and returns the answer.
@@ -313,19 +508,15 @@ class MjpgStream(QThread):
         if(host is None): host = self.host
         if(port is None): port = self.port
         if(path is None): path = self.path
-        # send get request and return response
-        http = httplib.HTTPConnection(host, port, timeout=3)
+        # send get request over a kept alive connection and return response
         try:
-            http.request("GET", path+query)
-            response = http.getresponse()
+            status, reason, data = self.pool.get(host, port, path+query)
         except:
             print "Connection to http://{0}:{1}{2}{3} refused".format(host, port, path, query)
             return None
-        if response.status != 200:
-            print response.status, response.reason
+        if status != 200:
+            print status, reason
             return None
-        data = response.read()
-        http.close()
         return data
 
     def sendCmd(self, value, cmd, group=None, plugin=None, dest=None):
@@ -369,6 +560,8 @@ class MjpgStream(QThread):
             dest = str(int(dest))
         # send request
         self.httpGet("?action=command&id="+cmd+"&dest="+dest+"&group="+group+"&value="+value+"&plugin="+plugin)
+        if((int(cmd), int(group)) != self.IN_CMD_UPDATE_CONTROLS):
+            self.invalidateControls(int(group))
 
     def hasCmd(self, cmd, group=None, plugin=None, dest=None):
         """Checks whether a command with the given id and group is known by the specified plugin.
@@ -390,6 +583,8 @@ class MjpgStream(QThread):
 
     def getCmdInfo(self, cmd, group=None, plugin=None, dest=None):
         """Returns a dictionary with informations on the queried command.
+        The controls are cached, the values of a group are read from the camera
+        again after CONTROLS_TTL seconds or after a command of the group was sent.
         
         Keyword arguments:
         cmd -- command id number or tuple constant
@@ -416,15 +611,48 @@ class MjpgStream(QThread):
             plugin = str(int(plugin))
         if(dest is None or (dest != self.DEST_INPUT and dest != self.DEST_OUTPUT)):
             dest = self.DEST_INPUT
-        if(self.updateControls):
-            self.sendCmd(group, self.IN_CMD_UPDATE_CONTROLS, plugin, dest)
-        # get list of controls and search for the matching one
+        key = (int(plugin), dest)
+        group = int(group)
+        with self.controlsLock:
+            stale = time.time() - self.controlsTime.get(key + (group,), 0.0) > self.CONTROLS_TTL
+        if(stale):
+            if(self.updateControls):
+                self.sendCmd(group, self.IN_CMD_UPDATE_CONTROLS, plugin=plugin, dest=dest)
+            self.refreshControls(plugin, dest, group)
+        with self.controlsLock:
+            return self.controls.get(key, {}).get((group, int(cmd)))
+
+    def refreshControls(self, plugin, dest, group):
+        """Reads the list of controls into the cache and marks the values of a group as current.
+        On error the cache is kept and read again on the next call.
+        
+        Keyword arguments:
+        plugin -- plugin number
+        dest -- command destination
+        group -- command group number which values were updated
+        
+        """
         data = self.getControls(plugin, dest)
-        if(data != None):
-            for info in data:
-                if(int(info["group"]) == int(group) and int(info["id"]) == int(cmd)):
-                    return info
-        return None
+        if(data is None):
+            return
+        controls = {}
+        for info in data:
+            controls[(int(info["group"]), int(info["id"]))] = info
+        with self.controlsLock:
+            self.controls[(int(plugin), dest)] = controls
+            self.controlsTime[(int(plugin), dest, int(group))] = time.time()
+
+    def invalidateControls(self, group=None):
+        """Makes the next getCmdInfo read the values of a group from the camera again.
+        
+        Keyword arguments:
+        group -- command group number (default None, all groups)
+        
+        """
+        with self.controlsLock:
+            for key in self.controlsTime.keys():
+                if(group is None or key[2] == group):
+                    del self.controlsTime[key]
 
     def getControls(self, plugin=None, dest=None):
         """Returns a list with information on all commands supported by the 
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""Provides MotorHistory, a fixed size history of timestamped positions and states
+for a set of axes, kept in preallocated numpy ring buffers.
+Depends on numpy.
+
+"""
+
+import threading
+import numpy
+
+
+class MotorHistory():
+    """Ring buffer of (time, position, state) samples per axis. Appending is O(1)
+    and memory stays bounded, the oldest samples are overwritten once an axis
+    has more than size samples. Timestamps of an axis are kept monotonic, so
+    range queries and interpolation can use binary searches.
+
+    """
+
+    STATE_UNKNOWN = -1
+
+    def __init__(self, axes, size=100000):
+        """Preallocates the buffers.
+
+        Keyword arguments:
+        axes -- list of axis names
+        size -- number of samples kept per axis (default 100000)
+
+        """
+        self.axes = dict((axis, row) for row, axis in enumerate(axes))
+        self.size = int(size)
+        self.times = numpy.zeros((len(axes), self.size), dtype=numpy.float64)
+        self.positions = numpy.zeros((len(axes), self.size), dtype=numpy.float64)
+        self.states = numpy.zeros((len(axes), self.size), dtype=numpy.int16)
+        self.index = numpy.zeros(len(axes), dtype=numpy.int64)    # next write position
+        self.count = numpy.zeros(len(axes), dtype=numpy.int64)    # valid samples
+        self.lock = threading.Lock()
+
+    def append(self, axis, timestamp, position, state=None):
+        """Stores one sample of an axis.
+
+        Keyword arguments:
+        axis -- axis name
+        timestamp -- time of the sample in seconds since the epoch
+        position -- position of the axis
+        state -- DevState of the axis (default None, stored as STATE_UNKNOWN)
+
+        """
+        row = self.axes[axis]
+        try:
+            state = int(state)
+        except (TypeError, ValueError):
+            state = self.STATE_UNKNOWN
+        with self.lock:
+            i = self.index[row]
+            if self.count[row] and timestamp < self.times[row, i - 1]:
+                # samples from events and polls may arrive slightly out of order
+                timestamp = self.times[row, i - 1]
+            self.times[row, i] = timestamp
+            self.positions[row, i] = position
+            self.states[row, i] = state
+            self.index[row] = (i + 1) % self.size
+            if self.count[row] < self.size:
+                self.count[row] += 1
+
+    def query(self, axis, start=None, stop=None):
+        """Returns all samples of an axis with start <= time <= stop in chronological order.
+
+        Keyword arguments:
+        axis -- axis name
+        start -- first time of the range (default None, oldest sample)
+        stop -- last time of the range (default None, newest sample)
+
+        Return value:
+        tuple of numpy arrays (times, positions, states)
+
+        """
+        row = self.axes[axis]
+        with self.lock:
+            first = 0
+            last = self.count[row]
+            if start is not None:
+                first = self.countBefore(row, start, "left")
+            if stop is not None:
+                last = self.countBefore(row, stop, "right")
+            indices = self.physical(row, numpy.arange(first, max(first, last)))
+            return self.times[row, indices], self.positions[row, indices], self.states[row, indices]
+
+    def positionAt(self, axis, timestamp):
+        """Returns the position of an axis at the given time, linearly interpolated
+        between the neighbouring samples.
+
+        Return value:
+        position or None if the time is outside of the stored history
+
+        """
+        row = self.axes[axis]
+        with self.lock:
+            n = self.countBefore(row, timestamp, "right")
+            if n == 0:
+                return None
+            before = self.physical(row, n - 1)
+            if self.times[row, before] == timestamp:
+                return float(self.positions[row, before])
+            if n == self.count[row]:
+                return None
+            after = self.physical(row, n)
+            return float(numpy.interp(timestamp, self.times[row, [before, after]], self.positions[row, [before, after]]))
+
+    def stateAt(self, axis, timestamp):
+        """Returns the state of an axis at the given time, i.e. the state of the last sample before it.
+
+        Return value:
+        state as integer or None if the time is before the stored history
+
+        """
+        row = self.axes[axis]
+        with self.lock:
+            n = self.countBefore(row, timestamp, "right")
+            if n == 0:
+                return None
+            return int(self.states[row, self.physical(row, n - 1)])
+
+    def latest(self, axis):
+        """Returns the newest sample of an axis as (time, position, state) or None.
+
+        """
+        row = self.axes[axis]
+        with self.lock:
+            if self.count[row] == 0:
+                return None
+            i = self.physical(row, self.count[row] - 1)
+            return float(self.times[row, i]), float(self.positions[row, i]), int(self.states[row, i])
+
+    def clear(self, axis=None):
+        with self.lock:
+            if axis is None:
+                self.index[:] = 0
+                self.count[:] = 0
+            else:
+                self.index[self.axes[axis]] = 0
+                self.count[self.axes[axis]] = 0
+
+    def segments(self, row):
+        # chronological (start, stop) index ranges of the valid samples
+        if self.count[row] < self.size:
+            return [(0, self.count[row])]
+        return [(self.index[row], self.size), (0, self.index[row])]
+
+    def countBefore(self, row, timestamp, side):
+        # number of samples with time < timestamp (side "left") or <= timestamp (side "right")
+        n = 0
+        for start, stop in self.segments(row):
+            n += numpy.searchsorted(self.times[row, start:stop], timestamp, side)
+        return int(n)
+
+    def physical(self, row, logical):
+        # maps chronological sample numbers to buffer indices
+        if self.count[row] < self.size:
+            return logical
+        return (self.index[row] + logical) % self.size
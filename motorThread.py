@@ -14,16 +14,85 @@ import ConfigParser
 import random
 import math
 import Queue
+import threading
+from multiprocessing.pool import ThreadPool
 from simulationDevice import SimulationDevice
+from moveHandle import MoveHandle
+from motorHistory import MotorHistory
+from tangoStats import InstrumentedProxy, stats
+from commandQueue import CommandQueue
 
 class MotorThread(QThread):
+    # motorised axes, each one has a proxy<Axis>, stateProxy<Axis> and current<Axis> attribute
+    AXES = ("ScanX", "ScanY", "Gonio", "GonioZ", "OnaxisX", "OnaxisY", "OnaxisZ", "BeamstopX", "BeamstopY")
+    # all devices in the order of the deviceservers list
+    DEVICES = ("ScanController", "StepperController") + AXES
+    # reconnect backoff in seconds, doubled after every failed attempt
+    RECONNECT_MIN = 1.0
+    RECONNECT_MAX = 60.0
+    # controller configuration sent on every (re)connect
+    CONTROLLER_SETUP = { \
+        "ScanController": ("SDA=3000000", "SDB=3000000"), \
+        "StepperController": ("SDA=3000000", "SDB=3000000", "SDC=3000000", "SDD=3000000", \
+                              "SDE=3000000", "SDF=3000000", "SDG=3000000", "SDH=3000000"), \
+    }
+    # default polling rates in Hz while moving and while idle, overridden per device by pollRates
+    POLL_RATE_MOVING = 50.0
+    POLL_RATE_IDLE = 1.0
+    # devices are polled at their moving rate for this long after a command, before they report MOVING
+    COMMAND_GRACE = 0.5
+    # seconds stopMotors waits for all axes to report they stopped
+    STOP_TIMEOUT = 5.0
+    # attributes read together in a single read_attributes call, (state, value) per device
+    SNAPSHOT_ATTRIBUTES = {"ScanController": ("State", "UserTask1Running")}
+    
     # A thread is started by calling QThread.start() never by calling run() directly!
-    def __init__(self,deviceservers,onaxisZmountposition, gonioZmountposition):
+    def __init__(self,deviceservers,onaxisZmountposition, gonioZmountposition, useEvents=False, pollRates=None, historySize=100000, statsInterval=0):
         QThread.__init__(self)
         print "Motor  thread: Starting thread"
         self.simulation = 1
         self.debugMode = 0
         self.alive = False
+        
+        # adaptive polling: moving axes (and the scan controller while UserTask1 runs) are polled
+        # at their moving rate, idle ones back off to their idle rate
+        if pollRates is None: pollRates = {}
+        self.pollIntervals = {}
+        self.nextPoll = {}
+        self.commandTime = {}
+        # pending MoveHandles per axis, completed by updateMoves whenever the axis is read
+        self.moves = {}
+        self.movesLock = threading.Lock()
+        for device in ("ScanController",) + self.AXES:
+            moving, idle = pollRates.get(device.lower(), (self.POLL_RATE_MOVING, self.POLL_RATE_IDLE))
+            self.pollIntervals[device] = (1.0 / moving, 1.0 / idle)
+            self.nextPoll[device] = 0.0
+            self.commandTime[device] = 0.0
+        
+        # event mode: the proxies push Position/State changes into the attributes below,
+        # axes without a working subscription are still polled by readAttributes
+        self.useEvents = useEvents
+        self.eventIds = []
+        self.subscribedAxes = set()
+        self.eventAxes = set()
+        self.snapshotLock = threading.Lock()
+        self.snapshotChanged = threading.Event()
+        self.snapshotTime = 0.0
+        # last (state, value) per device sent with update(PyQt_PyObject)
+        self.published = {}
+        # bounded history of all readings, for frame tagging and drift diagnostics without extra Tango reads
+        self.history = MotorHistory(("ScanController",) + self.AXES, historySize)
+        # per call latency statistics of all proxies, printed every statsInterval seconds if set
+        self.latencyStats = stats
+        self.statsInterval = statsInterval
+        self.lastStatsDump = time.time()
+        # one worker per device, so a snapshot takes as long as the slowest device instead of the sum
+        self.readPool = ThreadPool(len(self.DEVICES))
+        # separate pool, so a hanging poll can never delay a stop
+        self.stopPool = ThreadPool(len(self.AXES))
+        # commands submitted by the GUI run here, so the GUI thread never blocks on a device
+        self.commandQueue = CommandQueue()
+        self.connect(self.commandQueue,SIGNAL("errorSignal(PyQt_PyObject)"),self.forwardError)
         self.currentScanX = 0
         self.currentScanY = 0
         self.currentGonio = 0
@@ -57,94 +126,105 @@ class MotorThread(QThread):
         
         self.inMountPosition = False
         
+        # devices are connected in parallel by the running thread. A device that fails is marked
+        # degraded and reconnected with backoff, the other devices keep working.
+        self.degraded = set(self.DEVICES)
+        self.connecting = set()
+        # set once every device has been tried and the connected ones have been read
+        self.connected = threading.Event()
+        self.reconnectTime = {}
+        self.reconnectDelay = {}
+        self.errors = Queue.Queue()
+        self.limitsChanged = False
+        self.scanXMin = self.scanXMax = 0
+        self.scanYMin = self.scanYMax = 0
+        for device in self.DEVICES:
+            setattr(self, "proxy" + device, None)
+            self.reconnectTime[device] = 0.0
+            self.reconnectDelay[device] = self.RECONNECT_MIN
         if self.simulation:
             print "Motor thread in simulation mode"
-            self.proxyScanController = SimulationDevice()
-            self.proxyStepperController = SimulationDevice()
-            self.proxyScanX = SimulationDevice()
-            self.proxyScanY = SimulationDevice()
-            self.proxyGonio = SimulationDevice()
-            self.proxyGonioZ = SimulationDevice()
-            self.proxyOnaxisX = SimulationDevice()
-            self.proxyOnaxisY = SimulationDevice()
-            self.proxyOnaxisZ = SimulationDevice()
-            self.proxyBeamstopX = SimulationDevice()
-            self.proxyBeamstopY = SimulationDevice()
-            
-            self.proxyScanX.write_attribute("VelocityUnits",1500)
-            self.proxyScanY.write_attribute("VelocityUnits",1500)
-            self.proxyGonio.write_attribute("VelocityUnits",1500)
-            self.proxyGonioZ.write_attribute("VelocityUnits",1500)
-            self.proxyOnaxisX.write_attribute("VelocityUnits",1500)
-            self.proxyOnaxisY.write_attribute("VelocityUnits",1500)
-            self.proxyOnaxisZ.write_attribute("VelocityUnits",1500)
-            self.proxyBeamstopX.write_attribute("VelocityUnits",1500)
-            self.proxyBeamstopY.write_attribute("VelocityUnits",1500)
-            
-            self.proxyScanX.write_attribute("SoftCwLimit",2000)
-            self.proxyScanX.write_attribute("SoftCcwLimit",-2000)
-            self.proxyScanY.write_attribute("SoftCwLimit",2000)
-            self.proxyScanY.write_attribute("SoftCcwLimit",-2000)
-             
-            
-        else:
-            try:
-                
-                self.proxyScanController = DeviceProxy(self.deviceservers[0])
-                self.proxyStepperController = DeviceProxy(self.deviceservers[1])
-                self.proxyScanX = DeviceProxy(self.deviceservers[2])
-                self.proxyScanY = DeviceProxy(self.deviceservers[3])
-                self.proxyGonio = DeviceProxy(self.deviceservers[4])
-                self.proxyGonioZ = DeviceProxy(self.deviceservers[5])
-                self.proxyOnaxisX = DeviceProxy(self.deviceservers[6])
-                self.proxyOnaxisY = DeviceProxy(self.deviceservers[7])
-                self.proxyOnaxisZ = DeviceProxy(self.deviceservers[8])
-                self.proxyBeamstopX = DeviceProxy(self.deviceservers[9])
-                self.proxyBeamstopY = DeviceProxy(self.deviceservers[10])
-                
-                if self.proxyScanX.state() == DevState.OFF: self.proxyScanX.command_inout("Enable")
-                if self.proxyScanY.state() == DevState.OFF: self.proxyScanY.command_inout("Enable")
-                if self.proxyGonio.state() == DevState.OFF: self.proxyGonio.command_inout("Enable")
-                if self.proxyGonioZ.state() == DevState.OFF: self.proxyGonioZ.command_inout("Enable")
-                if self.proxyOnaxisX.state() == DevState.OFF: self.proxyOnaxisX.command_inout("Enable")
-                if self.proxyOnaxisY.state() == DevState.OFF: self.proxyOnaxisY.command_inout("Enable")
-                if self.proxyOnaxisZ.state() == DevState.OFF: self.proxyOnaxisZ.command_inout("Enable")
-                if self.proxyBeamstopX.state() == DevState.OFF: self.proxyBeamstopX.command_inout("Enable")
-                if self.proxyBeamstopY.state() == DevState.OFF: self.proxyBeamstopY.command_inout("Enable")
-                
-            except:
-                self.alive = False
-                self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
-                raise
-            
-        print "Piezo thread: started"
-        
-        try:
-            self.scanXMax = self.proxyScanX.read_attribute("SoftCwLimit").value
-            self.scanXMin = self.proxyScanX.read_attribute("SoftCcwLimit").value
-        except:
-            self.scanXMax = self.proxyScanX.read_attribute("SoftCwLimit").value
-            self.scanXMin = self.proxyScanX.read_attribute("SoftCcwLimit").value
-            
+        self.alive = True
+    
+    def createProxy(self, device):
+        if not self.simulation:
+            return DeviceProxy(self.deviceservers[self.DEVICES.index(device)])
+        proxy = SimulationDevice()
+        if device in self.AXES:
+            proxy.write_attribute("VelocityUnits",1500)
+        if device in ("ScanX", "ScanY"):
+            proxy.write_attribute("SoftCwLimit",2000)
+            proxy.write_attribute("SoftCcwLimit",-2000)
+        return proxy
+    
+    def connectDevice(self, device):
+        # creates, enables and configures one device, runs in the worker pool
+        if self.debugMode: print "Motor thread: connectDevice(), device:", device
         try:
-            self.scanYMax = self.proxyScanY.read_attribute("SoftCwLimit").value
-            self.scanYMin = self.proxyScanY.read_attribute("SoftCcwLimit").value
+            proxy = InstrumentedProxy(self.createProxy(device), device, self.latencyStats)
+            if device in self.AXES:
+                if proxy.state() == DevState.OFF: proxy.command_inout("Enable")
+            for command in self.CONTROLLER_SETUP.get(device, ()):
+                proxy.command_inout("WriteRead", command)
+            if device in ("ScanX", "ScanY"):
+                limits = (proxy.read_attribute("SoftCcwLimit").value, proxy.read_attribute("SoftCwLimit").value)
+                proxy.write_attribute("Velocity",1500)
+                if device == "ScanX":
+                    self.scanXMin, self.scanXMax = limits
+                else:
+                    self.scanYMin, self.scanYMax = limits
+                self.limitsChanged = True
         except:
-            self.scanYMax = self.proxyScanY.read_attribute("SoftCwLimit").value
-            self.scanYMin = self.proxyScanY.read_attribute("SoftCcwLimit").value
-        self.alive = True
-        self.proxyScanController.command_inout("WriteRead","SDA=3000000")
-        self.proxyScanController.command_inout("WriteRead","SDB=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDA=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDB=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDC=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDD=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDE=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDF=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDG=3000000")
-        self.proxyStepperController.command_inout("WriteRead","SDH=3000000")
-        self.proxyScanX.write_attribute("Velocity",1500)
-        self.proxyScanY.write_attribute("Velocity",1500)
+            self.markDegraded(device, sys.exc_info()[1])
+            self.connecting.discard(device)
+            return False
+        setattr(self, "proxy" + device, proxy)
+        self.reconnectDelay[device] = self.RECONNECT_MIN
+        if self.useEvents and device != "StepperController":
+            self.subscribeDevice(device)
+        self.degraded.discard(device)
+        self.connecting.discard(device)
+        self.pollSoon(device)
+        print "Motor thread: connected", device
+        return True
+    
+    def connectDevices(self):
+        # connects all devices at once, returns when every device is either connected or degraded
+        devices = [device for device in self.DEVICES if device in self.degraded and device not in self.connecting]
+        self.connecting.update(devices)
+        self.readPool.map(self.connectDevice, devices)
+    
+    def reconnectDevices(self):
+        # starts background reconnects of degraded devices whose backoff has expired
+        now = time.time()
+        for device in list(self.degraded):
+            if device not in self.connecting and self.reconnectTime[device] <= now:
+                self.connecting.add(device)
+                self.readPool.apply_async(self.connectDevice, (device,))
+    
+    def markDegraded(self, device, error):
+        # takes a device out of the poll loop until it has been reconnected
+        if device not in self.degraded:
+            print "Motor thread: device", device, "degraded:", error
+            self.errors.put("%s: %s" % (device, error))
+        self.degraded.add(device)
+        self.unsubscribeDevice(device)
+        self.reconnectTime[device] = time.time() + self.reconnectDelay[device]
+        self.reconnectDelay[device] = min(2 * self.reconnectDelay[device], self.RECONNECT_MAX)
+        if device != "StepperController":
+            with self.snapshotLock:
+                setattr(self, self.snapshotTargets(device)[0], DevState.UNKNOWN)
+        # the device is no longer read, so its pending moves would never complete
+        with self.movesLock:
+            handles = self.moves.pop(device, [])
+        for handle in handles:
+            handle.fail(error)
+    
+    def checkConnected(self, device):
+        # refuses commands to a degraded device, its proxy may not exist yet
+        if device in self.degraded:
+            raise Exception("%s is not connected" % device)
+    
     def stop(self):
         print "Motor thread: Stopping thread"
         self.alive = False
@@ -153,10 +233,34 @@ class MotorThread(QThread):
     def run(self):
         print "Motor thread: started"
         self.alive = True
+        self.commandQueue.start()
+        self.connectDevices()
+        # the first readings are in place before anyone is told the devices are connected
+        self.readAttributes()
+        self.connected.set()
+        if self.useEvents:
+            print "Motor thread: event driven axes:", ", ".join(sorted(self.eventAxes))
         while self.alive:
-            time.sleep(0.1)
+            # wake up when the next device is due, an event arrives or a command was sent
+            self.snapshotChanged.wait(self.nextPollDelay())
+            self.snapshotChanged.clear()
+            self.reconnectDevices()
             self.readAttributes()
-            self.emit(SIGNAL("update()"))
+            # only devices whose state or value changed are published to the GUI
+            changes = self.changedDevices()
+            if changes:
+                self.emit(SIGNAL("update(PyQt_PyObject)"),changes)
+            if self.limitsChanged:
+                self.limitsChanged = False
+                self.emit(SIGNAL("limitsChanged()"))
+            while not self.errors.empty():
+                self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),self.errors.get())
+            if self.statsInterval and time.time() - self.lastStatsDump >= self.statsInterval:
+                self.latencyStats.dump()
+                self.lastStatsDump = time.time()
+        self.commandQueue.stop()
+        self.unsubscribeEvents()
+        self.readPool.terminate()
         # exit position of run function of thread. if exiting == true we end up here
         self.valid = 0
         self.status = "OFFLINE"
@@ -168,37 +272,154 @@ class MotorThread(QThread):
         self.alive = False
 
     def readAttributes(self):
+        # reads the devices that are due and reschedules them, returns True if anything was read
+        now = time.time()
+        devices = [device for device in self.polledDevices() if self.nextPoll[device] <= now]
+        if not devices:
+            return False
+        timestamp, readings = self.readSnapshot(devices)
+        self.applySnapshot(timestamp, readings)
+        for device, (state, value) in readings.items():
+            moving, idle = self.pollIntervals[device]
+            if self.isMoving(device, state, value) or now - self.commandTime[device] < self.COMMAND_GRACE \
+                    or self.moves.get(device):
+                self.nextPoll[device] = now + moving
+            else:
+                self.nextPoll[device] = now + idle
+        return True
+    
+    def polledDevices(self):
+        # event driven axes are polled as well while a move on them is pending
+        return [device for device in ("ScanController",) + self.AXES if device not in self.degraded
+                and (device not in self.eventAxes or self.moves.get(device))]
+    
+    def nextPollDelay(self):
+        # time until the next device is due, event driven devices only need the idle heartbeat
+        nextPoll = [self.nextPoll[device] for device in self.polledDevices()]
+        if not nextPoll:
+            return 1.0 / self.POLL_RATE_IDLE
+        return min(max(min(nextPoll) - time.time(), 0.0), 1.0 / self.POLL_RATE_IDLE)
+    
+    def isMoving(self, device, state, value):
+        if device == "ScanController":
+            return bool(value)
+        return state == DevState.MOVING
+    
+    def pollSoon(self, device):
+        # called after commands, so the device switches to its moving rate right away
+        self.nextPoll[device] = 0.0
+        self.commandTime[device] = time.time()
+        self.snapshotChanged.set()
+    
+    def readDevice(self, device):
+        proxy = getattr(self, "proxy" + device)
         try:
-            self.stateProxyScanController = self.proxyScanController.state()
-            self.stateProxyScanX = self.proxyScanX.state()
-            self.stateProxyScanY = self.proxyScanY.state()
-            self.stateProxyGonio = self.proxyGonio.state()
-            self.stateProxyGonioZ = self.proxyGonioZ.state()
-            self.stateProxyOnaxisX = self.proxyOnaxisX.state()
-            self.stateProxyOnaxisY = self.proxyOnaxisY.state()
-            self.stateProxyOnaxisZ = self.proxyOnaxisZ.state()
-            self.stateProxyBeamstopX = self.proxyBeamstopX.state()
-            self.stateProxyBeamstopY = self.proxyBeamstopY.state()
-            
-             
-            self.currentScanX = self.proxyScanX.read_attribute("Position").value
-            self.currentScanY = self.proxyScanY.read_attribute("Position").value
-            self.currentGonio = self.proxyGonio.read_attribute("Position").value
-            self.currentGonioZ = self.proxyGonioZ.read_attribute("Position").value
-            self.currentOnaxisX  = self.proxyOnaxisX.read_attribute("Position").value
-            self.currentOnaxisY  = self.proxyOnaxisY.read_attribute("Position").value
-            self.currentOnaxisZ  = self.proxyOnaxisZ.read_attribute("Position").value
-            self.currentBeamstopX  = self.proxyBeamstopX.read_attribute("Position").value
-            self.currentBeamstopY  = self.proxyBeamstopY.read_attribute("Position").value
-            self.stateTask1 = self.proxyScanController.read_attribute("UserTask1Running").value
-            
+            state, value = proxy.read_attributes(list(self.SNAPSHOT_ATTRIBUTES.get(device, ("State", "Position"))))
         except:
-            self.alive = False
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+            self.markDegraded(device, sys.exc_info()[1])
+            return device, None
+        return device, (state.value, value.value)
+    
+    def readSnapshot(self, devices):
+        # reads all devices at once, returns (timestamp, {device: (state, value)}) without the devices that failed
+        timestamp = time.time()
+        readings = dict([reading for reading in self.readPool.map(self.readDevice, devices) if reading[1] is not None])
+        return timestamp, readings
+    
+    def applySnapshot(self, timestamp, readings):
+        with self.snapshotLock:
+            for device, values in readings.items():
+                for target, value in zip(self.snapshotTargets(device), values):
+                    setattr(self, target, value)
+            self.snapshotTime = timestamp
+        for device, (state, value) in readings.items():
+            self.history.append(device, timestamp, value, state)
+            self.updateMoves(device)
+    
+    def changedDevices(self):
+        # {device: (state, value)} of the devices that changed since the last call
+        changes = {}
+        with self.snapshotLock:
+            for device in ("ScanController",) + self.AXES:
+                reading = tuple([getattr(self, target) for target in self.snapshotTargets(device)])
+                if self.published.get(device) != reading:
+                    self.published[device] = reading
+                    changes[device] = reading
+        return changes
+    
+    def snapshotTargets(self, device):
+        # attribute names holding the (state, value) pair of a device
+        if device == "ScanController":
+            return ("stateProxyScanController", "stateTask1")
+        return ("stateProxy" + device, "current" + device)
+    
+    def subscribeDevice(self, device):
+        if self.debugMode: print "Motor thread: subscribeDevice(), device:", device
+        proxy = getattr(self, "proxy" + device)
+        stateTarget, valueTarget = self.snapshotTargets(device)
+        valueAttribute = self.SNAPSHOT_ATTRIBUTES.get(device, ("State", "Position"))[1]
+        if self.subscribeEvent(proxy, valueAttribute, device, valueTarget) and \
+                self.subscribeEvent(proxy, "State", device, stateTarget):
+            self.subscribedAxes.add(device)
+            self.eventAxes.add(device)
+    
+    def subscribeEvent(self, proxy, attribute, axis, target):
+        # change events need the attribute to be polled or pushed by the device server, periodic
+        # events only need polling. If neither is configured the axis stays on the poll loop.
+        callback = self.eventCallback(axis, target)
+        for eventType in (EventType.CHANGE_EVENT, EventType.PERIODIC_EVENT):
+            try:
+                self.eventIds.append((axis, proxy, proxy.subscribe_event(attribute, eventType, callback)))
+                return True
+            except:
+                pass
+        return False
+    
+    def eventCallback(self, axis, target):
+        def callback(event):
+            if event.err or event.attr_value is None:
+                # poll the axis until its events come back
+                self.eventAxes.discard(axis)
+                return
+            with self.snapshotLock:
+                setattr(self, target, event.attr_value.value)
+                state, value = [getattr(self, name) for name in self.snapshotTargets(axis)]
+            self.history.append(axis, time.time(), value, state)
+            self.updateMoves(axis)
+            if axis in self.subscribedAxes:
+                self.eventAxes.add(axis)
+            self.snapshotChanged.set()
+        return callback
+    
+    def unsubscribeEvents(self):
+        for device in self.DEVICES:
+            self.unsubscribeDevice(device)
+    
+    def unsubscribeDevice(self, device):
+        for eventId in [eventId for eventId in self.eventIds if eventId[0] == device]:
+            self.eventIds.remove(eventId)
+            try:
+                eventId[1].unsubscribe_event(eventId[2])
+            except:
+                pass
+        self.subscribedAxes.discard(device)
+        self.eventAxes.discard(device)
  
+    def submit(self, method, args=(), callback=None, priority=None):
+        # runs a MotorThread method in the command queue, callback gets its return value in the GUI thread
+        self.commandQueue.submit(getattr(self, method), args, callback, priority)
+    
+    def forwardError(self, error):
+        self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),error)
+    
+    def readSetpoint(self, axis):
+        if self.debugMode: print "Motor thread: readSetpoint(), axis:", axis
+        return getattr(self, "proxy" + axis).read_attribute("Position").w_value
+    
     def uploadScript(self, arg):
         if self.debugMode: print "Motor thread: uploadScript(), arg:", arg
         try:
+            self.checkConnected("ScanController")
             self.proxyScanController.command_inout("Upload", arg)
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
@@ -206,216 +427,247 @@ class MotorThread(QThread):
     def startScript(self, arg):
         if self.debugMode: print "Motor thread: startScript(), arg:", arg
         try:
+            self.checkConnected("ScanController")
             self.proxyScanController.command_inout("StartUserTask1", arg)
+            self.pollSoon("ScanController")
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
    
     def isScriptRunning(self):
+        # returns None if the scan controller could not be read, a degraded controller was already reported
         if self.debugMode: print "Motor thread: isScriptRunning()"
+        if "ScanController" in self.degraded:
+            return None
+        try:
+            return bool(self.proxyScanController.read_attribute("UserTask1Running").value)
+        except:
+            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+            return None
+    
+    def readVariable(self, name):
+        # reads a variable of the scan controller program, returns None if it could not be read
+        if self.debugMode: print "Motor thread: readVariable(), name:", name
+        if "ScanController" in self.degraded:
+            return None
+        try:
+            return float(self.proxyScanController.command_inout("WriteRead", name + "=?"))
+        except:
+            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+            return None
+    
+    def writeVariable(self, name, value):
+        self.writeVariables([(name, value)])
+    
+    def writeVariables(self, assignments):
+        # sets several program variables, assignments is a list of (name, value). One command per WriteRead:
+        # the controller answers every command of a line, a joined line would leave replies for the next read
+        if self.debugMode: print "Motor thread: writeVariables(), assignments:", assignments
         try:
-            value = self.proxyScanController.read_attribute("UserTask1Running").value
+            self.checkConnected("ScanController")
+            for assignment in assignments:
+                self.proxyScanController.command_inout("WriteRead", "%s=%s" % assignment)
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
-        return bool(value)
     
     def checkBeamDump(self):
+        # returns None if the beam dump flag could not be read
         if self.debugMode: print "Motor thread: checkBeamDump()"
+        if "ScanController" in self.degraded:
+            return None
         try:
-            value = int(self.proxyScanController.command_inout("BEAMDPE=?"))
+            return bool(int(self.proxyScanController.command_inout("BEAMDPE=?")))
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
-        return bool(value)
+            return None
    
     def setScanX(self,arg):
         if self.debugMode: print "Motor thread: setScanX(), arg:", arg
-        try:
-            self.proxyScanX.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("ScanX", arg)
     def calibrateScanX(self,arg):
         if self.debugMode: print "Motor thread: calibrateScanX(), arg:", arg
         try:
-            self.proxyScanX.command_inout("Calibrate", arg)  
+            self.proxyScanX.command_inout("Calibrate", arg)
+            self.pollSoon("ScanX")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
     
     def setScanY(self,arg):
         if self.debugMode: print "Motor thread: setScanY(), arg:", arg
-        try:
-            self.proxyScanY.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("ScanY", arg)
     def calibrateScanY(self,arg):
         if self.debugMode: print "Motor thread: calibrateScanY(), arg:", arg
         try:
-            self.proxyScanY.command_inout("Calibrate", arg)  
+            self.proxyScanY.command_inout("Calibrate", arg)
+            self.pollSoon("ScanY")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
             
     def setGonio(self,arg):
         if self.debugMode: print "Motor thread: setGonio(), arg:", arg
-        try:
-            self.proxyGonio.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("Gonio", arg)
     def calibrateGonio(self,arg):
         if self.debugMode: print "Motor thread: calibrateGonio(), arg:", arg
         try:
-            self.proxyGonio.command_inout("Calibrate", arg)  
+            self.proxyGonio.command_inout("Calibrate", arg)
+            self.pollSoon("Gonio")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
                         
     def setGonioZ(self,arg):
         if self.debugMode: print "Motor thread: setGonioZ(), arg:", arg
-        try:
-            self.proxyGonioZ.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("GonioZ", arg)
     def calibrateGonioZ(self,arg):
         if self.debugMode: print "Motor thread: calibrateGonioZ(), arg:", arg
         try:
-            self.proxyGonioZ.command_inout("Calibrate", arg)  
+            self.proxyGonioZ.command_inout("Calibrate", arg)
+            self.pollSoon("GonioZ")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
             
     def setOnaxisX(self,arg):
         if self.debugMode: print "Motor thread: setOnaxisX(), arg:", arg
-        try:
-            self.proxyOnaxisX.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("OnaxisX", arg)
     def calibrateOnaxisX(self,arg):
         if self.debugMode: print "Motor thread: calibrateOnaxisX(), arg:", arg
         try:
-            self.proxyOnaxisX.command_inout("Calibrate", arg)  
+            self.proxyOnaxisX.command_inout("Calibrate", arg)
+            self.pollSoon("OnaxisX")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
 
     def setOnaxisY(self,arg):
         if self.debugMode: print "Motor thread: setOnaxisY(), arg:", arg
-        try:
-            self.proxyOnaxisY.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("OnaxisY", arg)
     def calibrateOnaxisY(self,arg):
         if self.debugMode: print "Motor thread: calibrateOnaxisY(), arg:", arg
         try:
-            self.proxyOnaxisY.command_inout("Calibrate", arg)  
+            self.proxyOnaxisY.command_inout("Calibrate", arg)
+            self.pollSoon("OnaxisY")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
             
     def setOnaxisZ(self,arg):
         if self.debugMode: print "Motor thread: setOnaxisZ(), arg:", arg
-        try:
-            self.proxyOnaxisZ.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("OnaxisZ", arg)
     def calibrateOnaxisZ(self,arg):
         if self.debugMode: print "Motor thread: calibrateOnaxisZ(), arg:", arg
         try:
-            self.proxyOnaxisZ.command_inout("Calibrate", arg)  
+            self.proxyOnaxisZ.command_inout("Calibrate", arg)
+            self.pollSoon("OnaxisZ")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
             
     def setBeamstopX(self,arg):
         if self.debugMode: print "Motor thread: setBeamstopX(), arg:", arg
-        try:
-            self.proxyBeamstopX.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return self.moveAxis("BeamstopX", arg)
     def calibrateBeamstopX(self,arg):
         if self.debugMode: print "Motor thread: calibrateBeamstopX(), arg:", arg
         try:
-            self.proxyBeamstopX.command_inout("Calibrate", arg)  
+            self.proxyBeamstopX.command_inout("Calibrate", arg)
+            self.pollSoon("BeamstopX")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
 
     def setBeamstopY(self,arg):
         if self.debugMode: print "Motor thread: setBeamstopY(), arg:", arg
-        try:
-            self.proxyBeamstopY.write_attribute("Position", arg)  
-            
-        except:
-            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])                                    
+        return self.moveAxis("BeamstopY", arg)
     def calibrateBeamstopY(self,arg):
         if self.debugMode: print "Motor thread: calibrateBeamstopY(), arg:", arg
         try:
-            self.proxyBeamstopY.command_inout("Calibrate", arg)  
+            self.proxyBeamstopY.command_inout("Calibrate", arg)
+            self.pollSoon("BeamstopY")
             
         except:
             self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
     
     def setMountPosition(self,arg):
         if self.debugMode: print "Motor thread: setOnaxisZoutposition(), arg:", arg
+        # gonio Z only follows if the onaxis Z move was accepted
         if arg:
-            try:
-                self.prevOnaxisZposition = self.currentOnaxisZ
-                self.proxyOnaxisZ.write_attribute("Position", self.onaxisZmountposition)
-                self.prevGonioZposition = self.currentGonioZ
-                self.proxyGonioZ.write_attribute("Position", self.gonioZmountposition)
-                
-                self.inMountPosition = True  
-            
-            except:
-                print sys.exc_info()[1]
-                self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
-                
+            self.prevOnaxisZposition = self.currentOnaxisZ
+            self.prevGonioZposition = self.currentGonioZ
+            handles = [self.moveAxis("OnaxisZ", self.onaxisZmountposition)]
+            if handles[0].error is None:
+                handles.append(self.moveAxis("GonioZ", self.gonioZmountposition))
         else:
-            try:
-                self.proxyOnaxisZ.write_attribute("Position", self.prevOnaxisZposition)
-                self.proxyGonioZ.write_attribute("Position", self.prevGonioZposition)
-                self.inMountPosition = False  
+            handles = [self.moveAxis("OnaxisZ", self.prevOnaxisZposition)]
+            if handles[0].error is None:
+                handles.append(self.moveAxis("GonioZ", self.prevGonioZposition))
+        if not [handle for handle in handles if handle.error is not None]:
+            self.inMountPosition = bool(arg)
+        return handles
+    
+    def moveAxis(self, axis, arg):
+        # starts a move and returns a MoveHandle, which completes once the axis has settled
+        handle = MoveHandle(axis, arg)
+        try:
+            self.checkConnected(axis)
+            getattr(self, "proxy" + axis).write_attribute("Position", arg)
+            with self.movesLock:
+                if axis in self.degraded:
+                    # degraded while the move was sent, markDegraded has already failed the pending moves
+                    raise Exception("%s is not connected" % axis)
+                self.moves.setdefault(axis, []).append(handle)
+            self.pollSoon(axis)
             
-            except:
-                self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])      
+        except:
+            handle.fail(sys.exc_info()[1])
+            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
+        return handle
+    
+    def updateMoves(self, axis):
+        with self.movesLock:
+            handles = self.moves.get(axis)
+            if not handles:
+                return
+            self.moves[axis] = []
+        state, position = [getattr(self, target) for target in self.snapshotTargets(axis)]
+        for handle in handles:
+            handle.update(state, position)
+        with self.movesLock:
+            self.moves[axis] = [handle for handle in handles if not handle.done()] + self.moves[axis]
         
-    def stopMotors(self):
+    def stopMotors(self, timeout=None):
+        # sends Stop to all axes at the same moment, then waits until none of them reports MOVING.
+        # Returns the axes that could not be confirmed as stopped within the timeout.
         if self.debugMode: print "Motor thread: stopMotors()"
-        if self.proxyScanX.state() == DevState.MOVING: self.proxyScanX.command_inout("Stop")
-        if self.proxyScanY.state() == DevState.MOVING: self.proxyScanY.command_inout("Stop")
-        if self.proxyGonio.state() == DevState.MOVING: self.proxyGonio.command_inout("Stop")
-        if self.proxyGonioZ.state() == DevState.MOVING: self.proxyGonioZ.command_inout("Stop")
-        if self.proxyOnaxisX.state() == DevState.MOVING: self.proxyOnaxisX.command_inout("Stop")
-        if self.proxyOnaxisY.state() == DevState.MOVING: self.proxyOnaxisY.command_inout("Stop")
-        if self.proxyOnaxisZ.state() == DevState.MOVING: self.proxyOnaxisZ.command_inout("Stop")
-        if self.proxyBeamstopX.state() == DevState.MOVING: self.proxyBeamstopX.command_inout("Stop")
-        if self.proxyBeamstopY.state() == DevState.MOVING: self.proxyBeamstopY.command_inout("Stop")
-            
-        moving = True
-        while moving:
-            try:
-                x = 0
-                if self.proxyScanX.state() == DevState.MOVING: x+=1
-                if self.proxyScanY.state() == DevState.MOVING: x+=1
-                if self.proxyGonio.state() == DevState.MOVING: x+=1
-                if self.proxyGonioZ.state() == DevState.MOVING: x+=1
-                if self.proxyOnaxisX.state() == DevState.MOVING: x+=1
-                if self.proxyOnaxisY.state() == DevState.MOVING: x+=1
-                if self.proxyOnaxisZ.state() == DevState.MOVING: x+=1
-                if self.proxyBeamstopX.state() == DevState.MOVING: x+=1
-                if self.proxyBeamstopY.state() == DevState.MOVING: x+=1
-            
-                if x>0: moving = False
-            except:
-                moving = False
-                self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),sys.exc_info()[1])
-            
-            else:
-                moving = False
-  
+        if timeout is None: timeout = self.STOP_TIMEOUT
+        deadline = time.time() + timeout
+        self.stopPool.map(self.stopAxis, self.AXES)
+        offline = [axis for axis in self.AXES if axis in self.degraded]
+        moving = [axis for axis in self.AXES if axis not in self.degraded]
+        while True:
+            states = self.stopPool.map(self.readState, moving)
+            moving = [axis for axis, state in zip(moving, states) if state is None or state == DevState.MOVING]
+            if not moving or time.time() >= deadline:
+                break
+            time.sleep(0.01)
+        for axis in self.AXES:
+            self.pollSoon(axis)
+        moving += offline
+        if moving:
+            print "Motor thread: axes did not stop:", ", ".join(moving)
+            self.emit(SIGNAL("errorSignal(PyQt_PyObject)"),"Axes did not stop: " + ", ".join(moving))
+        return moving
+    
+    def stopAxis(self, axis):
+        try:
+            getattr(self, "proxy" + axis).command_inout("Stop")
+            self.pollSoon(axis)
+        except:
+            # not fatal, readState decides whether the axis stopped
+            print "Motor thread: Stop failed on", axis, sys.exc_info()[1]
+    
+    def readState(self, axis):
+        try:
+            return getattr(self, "proxy" + axis).state()
+        except:
+            return None
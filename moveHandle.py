@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Provides MoveHandle, a handle on a single motor move that can be waited on,
+and helpers to wait for several moves or for a bare DeviceProxy.
+Depends on PyTango.
+
+"""
+
+import threading
+import time
+from PyTango import DevState
+
+
+class MoveHandle():
+    """Completes as soon as the axis reports it has settled, i.e. it is no longer
+    MOVING and either was seen moving or already sits at the target. Moves that
+    never report MOVING (target already reached, rejected by the controller) are
+    considered done after START_TIMEOUT.
+
+    """
+
+    START_TIMEOUT = 0.5     # seconds a move may take to report MOVING
+    TOLERANCE = 0.01        # position tolerance when no tolerance is given
+
+    def __init__(self, axis, target=None, tolerance=None):
+        self.axis = axis
+        self.target = target
+        if tolerance is None: tolerance = self.TOLERANCE
+        self.tolerance = tolerance
+        self.startTime = time.time()
+        self.seenMoving = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.finished = False
+        self.waiters = []
+
+    def update(self, state, position):
+        """Feeds a new state/position reading of the axis into the handle.
+
+        """
+        if self.finished:
+            return
+        if state == DevState.MOVING:
+            self.seenMoving = True
+            return
+        if self.seenMoving or self.atTarget(position) or time.time() - self.startTime > self.START_TIMEOUT:
+            self.complete()
+
+    def atTarget(self, position):
+        if self.target is None or position is None:
+            return False
+        try:
+            return abs(float(position) - float(self.target)) <= self.tolerance
+        except (TypeError, ValueError):
+            return False
+
+    def fail(self, error):
+        """Completes the handle with an error, e.g. when the move command was refused.
+
+        """
+        self.error = error
+        self.complete()
+
+    def complete(self):
+        with self.lock:
+            self.finished = True
+            waiters = self.waiters
+            self.waiters = []
+        for waiter in waiters:
+            waiter.set()
+
+    def done(self):
+        return self.finished
+
+    def addWaiter(self, event):
+        with self.lock:
+            if not self.finished:
+                self.waiters.append(event)
+                return
+        event.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the move has settled.
+
+        Keyword arguments:
+        timeout -- maximum time to wait in seconds (default None, wait forever)
+
+        Return value:
+        True if the move settled in time, False otherwise
+
+        """
+        return waitAll([self], timeout)
+
+
+def waitAll(handles, timeout=None):
+    """Blocks until all given moves have settled.
+
+    Keyword arguments:
+    handles -- list of MoveHandle instances
+    timeout -- maximum time to wait in seconds (default None, wait forever)
+
+    Return value:
+    True if all moves settled in time, False otherwise
+
+    """
+    # Event.wait(timeout) polls in python 2, so the timeout is signalled by a timer instead
+    event = threading.Event()
+    expired = []
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, lambda: (expired.append(True), event.set()))
+        timer.daemon = True
+        timer.start()
+    try:
+        while True:
+            event.clear()
+            pending = [handle for handle in handles if not handle.done()]
+            if not pending:
+                return True
+            if expired:
+                return False
+            for handle in pending:
+                handle.addWaiter(event)
+            event.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+
+def waitForMove(proxy, target=None, timeout=None, interval=0.01, tolerance=None):
+    """Polls a bare DeviceProxy until its move has settled, for scripts that run
+    without a MotorThread.
+
+    Keyword arguments:
+    proxy -- DeviceProxy of the moving axis
+    target -- commanded position (default None, only the state is checked)
+    tolerance -- position tolerance (default MoveHandle.TOLERANCE)
+    timeout -- maximum time to wait in seconds (default None, wait forever)
+    interval -- polling interval in seconds (default 0.01)
+
+    Return value:
+    True if the move settled in time, False otherwise
+
+    """
+    handle = MoveHandle(proxy, target, tolerance)
+    while not handle.done():
+        if timeout is not None and time.time() - handle.startTime > timeout:
+            return False
+        handle.update(proxy.state(), proxy.read_attribute("Position").value)
+        if not handle.done():
+            time.sleep(interval)
+    return True
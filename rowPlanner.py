@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""Provides RowPlanner, which chooses the order and direction in which a set of
+raster rows is scanned.
+
+"""
+
+
+class RowPlanner():
+    """Plans any subset of rows, e.g. a row range, a resumed scan or rows queued
+    for a rescan. The gonio angle of a row is fixed, the stage and the gonio move
+    to the next row at the same time, so the dead time between two rows is the
+    longer of both moves plus a penalty whenever the gonio has to turn around.
+
+    The cheapest of the two serpentines through the rows (top down and bottom up,
+    each entered at either end) and a nearest neighbour tour from the current
+    position is returned. Rows that were scanned before, e.g. retries and rows of
+    a resumed scan, keep their direction, only their order is planned.
+
+    """
+
+    STAGE_SPEED = 1500.0    # um/s, the velocity MotorThread sets for ScanX and ScanY
+    GONIO_SPEED = 10.0      # degrees per second
+    REVERSAL_PENALTY = 1.0  # seconds lost when the gonio changes its direction of rotation
+
+    def __init__(self, rows, gonioAngles=None, stageSpeed=None, gonioSpeed=None):
+        """Keyword arguments:
+        rows -- list of rows, each a list of points with x() and y() in um
+        gonioAngles -- gonio angle of every row (default None, no gonio moves)
+        stageSpeed -- stage speed in um/s (default STAGE_SPEED)
+        gonioSpeed -- gonio speed in degrees per second (default GONIO_SPEED)
+
+        """
+        if stageSpeed is None: stageSpeed = self.STAGE_SPEED
+        if gonioSpeed is None: gonioSpeed = self.GONIO_SPEED
+        self.rows = rows
+        self.gonioAngles = gonioAngles
+        self.stageSpeed = float(stageSpeed)
+        self.gonioSpeed = float(gonioSpeed)
+
+    def plan(self, indices, position=None, gonio=None, fixed=None):
+        """Plans the given rows.
+
+        Keyword arguments:
+        indices -- indices of the rows to scan, empty rows are dropped
+        position -- current stage position as (x, y) in um (default None, unknown)
+        gonio -- current gonio angle (default None, unknown)
+        fixed -- dictionary {row index: direction} of rows which direction must not change (default None)
+
+        Return value:
+        list of (row index, direction) in scan order, direction 1 scans a row from its
+        first to its last point, -1 the other way round
+
+        """
+        if fixed is None: fixed = {}
+        indices = sorted([i for i in set(indices) if len(self.rows[i]) > 0])
+        if not indices:
+            return []
+        candidates = []
+        for order in (indices, indices[::-1]):
+            for first in (1, -1):
+                candidates.append([(order[k], fixed.get(order[k], first * (-1) ** k)) for k in range(len(order))])
+        if position is not None:
+            candidates.append(self.nearestNeighbour(indices, position, gonio, fixed))
+        costs = [self.cost(candidate, position, gonio) for candidate in candidates]
+        return candidates[costs.index(min(costs))]
+
+    def cost(self, plan, position=None, gonio=None):
+        """Returns the dead time of a plan in seconds.
+
+        """
+        total = 0.0
+        rotation = 0
+        for i, direction in plan:
+            entry = self.entry(i, direction)
+            stage = 0.0
+            if position is not None:
+                stage = self.distance(position, entry) / self.stageSpeed
+            turn = 0.0
+            if self.gonioAngles is not None and gonio is not None:
+                step = self.gonioAngles[i] - gonio
+                turn = abs(step) / self.gonioSpeed
+                if step != 0:
+                    sign = cmp(step, 0)
+                    if rotation and sign != rotation:
+                        turn += self.REVERSAL_PENALTY
+                    rotation = sign
+            total += max(stage, turn)
+            position = self.exit(i, direction)
+            if self.gonioAngles is not None:
+                gonio = self.gonioAngles[i]
+        return total
+
+    def nearestNeighbour(self, indices, position, gonio, fixed):
+        # greedy tour, always continues with the row end that can be reached fastest
+        left = list(indices)
+        plan = []
+        while left:
+            best = None
+            for i in left:
+                for direction in (fixed.get(i, 1), fixed.get(i, -1)):
+                    step = self.cost([(i, direction)], position, gonio)
+                    if best is None or step < best[0]:
+                        best = (step, i, direction)
+            step, i, direction = best
+            plan.append((i, direction))
+            left.remove(i)
+            position = self.exit(i, direction)
+            if self.gonioAngles is not None:
+                gonio = self.gonioAngles[i]
+        return plan
+
+    def entry(self, i, direction):
+        if direction > 0:
+            point = self.rows[i][0]
+        else:
+            point = self.rows[i][-1]
+        return (point.x(), point.y())
+
+    def exit(self, i, direction):
+        return self.entry(i, -direction)
+
+    def distance(self, a, b):
+        # the axes move independently, so the slower one decides
+        return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Provides ScanEstimator, which predicts the duration of a raster scan before
+it starts and refines the prediction from the measured row durations.
+
+"""
+
+import time
+
+
+class ScanEstimator():
+    """A row takes (holes + 2 * acclPulses) / freq seconds of scanning plus the
+    gonio step to its angle plus a fixed overhead for moves, upload and start.
+    The overhead starts at ROW_OVERHEAD and follows the measured rows as an
+    exponentially weighted moving average, so the estimate adapts to the actual
+    setup within a few rows.
+
+    """
+
+    ROW_OVERHEAD = 1.0      # seconds per row before any row has been measured
+    GONIO_SPEED = 10.0      # degrees per second when no speed is given
+    SMOOTHING = 0.3         # weight of the newest row in the overhead average
+
+    def __init__(self, rows, freq, acclPulses, gonioAngles=None, gonioSpeed=None, overhead=None):
+        """Keyword arguments:
+        rows -- list of rows, each a list of points
+        freq -- machine frequency in Hz, one hole per pulse
+        acclPulses -- pulses used to accelerate before and decelerate after a row
+        gonioAngles -- gonio angle of every row (default None, no gonio steps)
+        gonioSpeed -- gonio speed in degrees per second (default GONIO_SPEED)
+        overhead -- initial per row overhead in seconds (default ROW_OVERHEAD)
+
+        """
+        if gonioSpeed is None: gonioSpeed = self.GONIO_SPEED
+        if overhead is None: overhead = self.ROW_OVERHEAD
+        self.freq = float(freq)
+        self.overhead = float(overhead)
+        self.rowCount = len(rows)
+        self.scanTimes = []
+        self.motionTimes = []
+        previous = None
+        for i in range(len(rows)):
+            duration = (len(rows[i]) + 2.0 * acclPulses) / self.freq
+            self.scanTimes.append(duration)
+            if gonioAngles is not None:
+                if previous is not None:
+                    duration += abs(gonioAngles[i] - previous) / gonioSpeed
+                previous = gonioAngles[i]
+            self.motionTimes.append(duration)
+        self.measured = 0
+        self.rowStarted = None
+        self.currentRow = None
+
+    def rowTime(self, i):
+        """Returns the predicted duration of row i in seconds.
+
+        """
+        return self.motionTimes[i] + self.overhead
+
+    def scanDuration(self, i):
+        """Returns the time the controller needs to scan row i in seconds, without moves and overhead.
+
+        """
+        return self.scanTimes[i]
+
+    def scanTime(self, indices=None):
+        """Returns the predicted duration of the given rows in seconds.
+
+        Keyword arguments:
+        indices -- row indices (default None, all rows)
+
+        """
+        if indices is None: indices = range(self.rowCount)
+        return sum([self.rowTime(i) for i in indices])
+
+    def startRow(self, i):
+        self.currentRow = i
+        self.rowStarted = time.time()
+
+    def finishRow(self, i, duration=None):
+        """Feeds the measured duration of row i into the overhead average.
+
+        Keyword arguments:
+        i -- row index
+        duration -- measured duration in seconds (default time since startRow)
+
+        """
+        if duration is None:
+            if self.rowStarted is None:
+                return
+            duration = time.time() - self.rowStarted
+        overhead = max(duration - self.motionTimes[i], 0.0)
+        if self.measured == 0:
+            self.overhead = overhead
+        else:
+            self.overhead += self.SMOOTHING * (overhead - self.overhead)
+        self.measured += 1
+        self.currentRow = None
+        self.rowStarted = None
+
+    def remaining(self, pending):
+        """Returns the predicted time left in seconds, including the rest of the running row.
+
+        Keyword arguments:
+        pending -- indices of the rows not started yet
+
+        """
+        remaining = self.scanTime(pending)
+        if self.currentRow is not None:
+            remaining += max(self.rowTime(self.currentRow) - (time.time() - self.rowStarted), 0.0)
+        return remaining
+
+    def rowFraction(self):
+        """Returns the predicted fraction of the running row already done, between 0 and 1.
+
+        """
+        if self.currentRow is None:
+            return 0.0
+        return min((time.time() - self.rowStarted) / self.rowTime(self.currentRow), 1.0)
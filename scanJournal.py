@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""Provides ScanJournal, an append-only record of the rows a scan has completed,
+so an interrupted scan can be resumed where it stopped.
+
+"""
+
+import os
+import json
+import time
+import hashlib
+
+
+class ScanJournal():
+    """One JSON record per line. A scan writes a "scan" record when it starts,
+    a "row" record for every completed row and a "finished" record at its end.
+    Every record is flushed to disk before the next row starts, a line cut off
+    by a crash is ignored when reading.
+
+    """
+
+    # parameters that have to match for a scan to continue an earlier one, the scan points
+    # are compared through their hash, see pointsHash
+    KEY_PARAMETERS = ("startRow", "stopRow", "angle", "freq", "acclPulses", "gonioStart", "gonioStop", "mode")
+
+    def __init__(self, path):
+        """Keyword arguments:
+        path -- journal file, created on the first record
+
+        """
+        self.path = path
+
+    def begin(self, parameters, rows, resume=False):
+        """Records the start of a scan.
+
+        Keyword arguments:
+        parameters -- LCLScollector parameters
+        rows -- number of rows of the scan
+        resume -- True if the scan continues the interrupted scan before it (default False)
+
+        """
+        record = {"type": "scan", "time": time.time(), "rows": rows, "resume": bool(resume)}
+        for key in self.KEY_PARAMETERS:
+            record[key] = parameters.get(key)
+        record["points"] = self.pointsHash(parameters.get("scanPoints", []))
+        self.append(record)
+
+    def rowDone(self, row, direction, gonio, beamDump, startTime, endTime=None):
+        """Records a completed row.
+
+        Keyword arguments:
+        row -- row number
+        direction -- scan direction of the row, 1 or -1
+        gonio -- gonio angle of the row
+        beamDump -- True if the beam was dumped during the row
+        startTime -- time the row was started
+        endTime -- time the row was finished (default now)
+
+        """
+        if endTime is None: endTime = time.time()
+        self.append({"type": "row", "row": int(row), "direction": int(direction), "gonio": float(gonio), \
+                     "beamDump": bool(beamDump), "start": startTime, "end": endTime})
+
+    def finish(self):
+        self.append({"type": "finished", "time": time.time()})
+
+    def append(self, record):
+        f = open(self.path, "a+")
+        try:
+            # a line cut off by a crash must not swallow the next record
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != "\n":
+                    f.write("\n")
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def records(self):
+        """Returns all complete records of the journal in order.
+
+        """
+        if not os.path.isfile(self.path):
+            return []
+        records = []
+        f = open(self.path, "r")
+        try:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+        finally:
+            f.close()
+        return records
+
+    def resumable(self, parameters, rows):
+        """Checks whether the last scan in the journal was interrupted and matches the given scan.
+
+        Keyword arguments:
+        parameters -- LCLScollector parameters of the new scan
+        rows -- number of rows of the new scan
+
+        Return value:
+        dictionary {row: record} of the rows the interrupted scan completed without a beam dump,
+        None if there is nothing to resume
+
+        """
+        last = None
+        completed = {}
+        for record in self.records():
+            if record.get("type") == "scan":
+                if not (record.get("resume") and last is not None):
+                    completed = {}
+                last = record
+            elif record.get("type") == "row" and last is not None:
+                if record["beamDump"]:
+                    completed.pop(record["row"], None)
+                else:
+                    completed[record["row"]] = record
+            elif record.get("type") == "finished":
+                last = None
+        if last is None or not completed or last.get("rows") != rows:
+            return None
+        for key in self.KEY_PARAMETERS:
+            if last.get(key) != parameters.get(key):
+                return None
+        # a re-aligned chip has the same rows at different positions
+        if last.get("points") != self.pointsHash(parameters.get("scanPoints", [])):
+            return None
+        return completed
+
+    def directions(self):
+        """Returns the direction of every row the last interrupted scan journaled,
+        including rows hit by a beam dump, so a resumed scan keeps them.
+
+        Return value:
+        dictionary {row: direction}
+
+        """
+        last = None
+        directions = {}
+        for record in self.records():
+            if record.get("type") == "scan":
+                if not (record.get("resume") and last is not None):
+                    directions = {}
+                last = record
+            elif record.get("type") == "row" and last is not None:
+                directions[record["row"]] = record["direction"]
+            elif record.get("type") == "finished":
+                last = None
+        if last is None:
+            return {}
+        return directions
+
+    def pointsHash(self, rows):
+        """Returns a hash of the scan positions, rounded to 1 nm.
+
+        Keyword arguments:
+        rows -- list of rows, each a list of points with x() and y() in um
+
+        """
+        digest = hashlib.sha1()
+        for row in rows:
+            digest.update(";".join(["%.3f,%.3f" % (point.x(), point.y()) for point in row]) + "|")
+        return digest.hexdigest()
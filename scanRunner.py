@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""Provides ScanRunner, which scans a queue of chips back to back through
+LCLScollector without an operator starting every scan. Can be run without the
+GUI: python scanRunner.py queue.json
+Depends on PyQt4.
+
+"""
+
+import sys
+import os
+import json
+import threading
+import ConfigParser
+from PyQt4 import QtCore
+from PyQt4.QtCore import SIGNAL, QThread
+from Raster import Raster
+from moveHandle import waitAll
+from dataCollectionThread import LCLScollector
+
+
+class ScanRunner(QThread):
+    """Every queue entry is a dictionary of LCLScollector parameters, e.g.
+    startRow, stopRow, freq, acclPulses, gonioStart and gonioStop, plus the keys
+    in RUNNER_KEYS. Missing parameters are taken from the defaults. The rows of
+    a chip come from its scanPoints or are computed from its geometry, see
+    rasterRows. The next chip is prepared while the current one is scanned, so
+    it starts as soon as the current one has finished.
+
+    An entry with mountPosition set moves to the mount position after its scan,
+    emits chipExchange(PyQt_PyObject) and waits for resume() before the next
+    chip. The next chip moves back to the sample position before it starts.
+    A chip that does not finish stops the queue.
+
+    The queue starts once the motor thread has connected its devices. A chip
+    is not started while a device it needs is degraded, this stops the queue
+    as well.
+
+    """
+
+    # entry keys used by the runner, all other keys are passed to LCLScollector
+    RUNNER_KEYS = ("name", "geometry", "mountPosition")
+    # devices a chip scan cannot run without
+    DEVICES = ("ScanController", "ScanX", "ScanY", "Gonio")
+
+    def __init__(self, motorThread, defaults=None):
+        """Keyword arguments:
+        motorThread -- running MotorThread
+        defaults -- parameters used for every entry that does not set them (default None)
+
+        """
+        QThread.__init__(self)
+        self.motorThread = motorThread
+        self.defaults = dict(defaults or {})
+        self.queue = []
+        self.queueLock = threading.Lock()
+        self.exchanged = threading.Event()
+        self.alive = False
+        self.collector = None
+        self.current = None
+        self.added = 0
+
+    def add(self, entry):
+        """Appends a chip to the queue, also while the queue is running.
+
+        Return value:
+        number of chips in the queue
+
+        """
+        entry = dict(entry)
+        with self.queueLock:
+            self.added += 1
+            entry.setdefault("name", "chip %d" % self.added)
+            self.queue.append(entry)
+            return len(self.queue)
+
+    def entries(self):
+        with self.queueLock:
+            return list(self.queue)
+
+    def clear(self):
+        with self.queueLock:
+            self.queue = []
+
+    def resume(self):
+        """Continues with the next chip after a chip exchange.
+
+        """
+        self.exchanged.set()
+
+    def stop(self):
+        print "Scan runner: Stopping thread"
+        self.alive = False
+        self.exchanged.set()
+        collector = self.collector
+        if collector is not None:
+            collector.join()
+        self.wait()
+
+    def run(self):
+        self.alive = True
+        print "Scan runner: started,", len(self.entries()), "chips queued"
+        while self.alive and not self.motorThread.connected.isSet():
+            self.motorThread.connected.wait(0.1)
+        prepared = self.prepare(self.takeEntry())
+        while self.alive and prepared is not None:
+            entry, collector = prepared
+            degraded = [device for device in self.DEVICES if device in self.motorThread.degraded]
+            if degraded:
+                print "Scan runner: chip", entry["name"], "not started, not connected:", ", ".join(degraded)
+                self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Chip %s not started, %s not connected, queue stopped." \
+                          % (entry["name"], ", ".join(degraded)))
+                break
+            self.current = entry
+            if self.motorThread.inMountPosition:
+                waitAll(self.motorThread.setMountPosition(False))
+            self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Scanning chip %s." % entry["name"])
+            self.emit(SIGNAL("chipStarted(PyQt_PyObject)"), entry)
+            self.collector = collector
+            collector.start()
+            # the rows of the next chip are computed while this one is scanned
+            prepared = self.prepare(self.takeEntry())
+            collector.wait()
+            self.collector = None
+            print "Scan runner: chip", entry["name"], "finished, completed:", collector.scanCompleted
+            self.emit(SIGNAL("chipFinished(PyQt_PyObject)"), (entry, collector.scanCompleted))
+            if not collector.scanCompleted:
+                if self.alive:
+                    self.emit(SIGNAL("logSignal(PyQt_PyObject)"),"Chip %s did not finish, queue stopped." % entry["name"])
+                break
+            if entry.get("mountPosition") and prepared is not None and self.alive:
+                waitAll(self.motorThread.setMountPosition(True))
+                self.exchanged.clear()
+                self.emit(SIGNAL("chipExchange(PyQt_PyObject)"), entry)
+                self.exchanged.wait()
+        if prepared is not None:
+            # put the prepared chip back, the queue can be started again
+            with self.queueLock:
+                self.queue.insert(0, prepared[0])
+        self.current = None
+        self.alive = False
+        print "Scan runner: queue finished"
+        self.emit(SIGNAL("queueFinished()"))
+
+    def takeEntry(self):
+        with self.queueLock:
+            if not self.queue:
+                return None
+            return self.queue.pop(0)
+
+    def prepare(self, entry):
+        """Builds the LCLScollector of a queue entry.
+
+        Return value:
+        tuple (entry, collector) or None if there is no entry
+
+        """
+        if entry is None:
+            return None
+        parameters = dict(self.defaults)
+        parameters.update(entry)
+        if "scanPoints" not in parameters:
+            # an entry only has to give the geometry values that differ from the defaults
+            geometry = dict(self.defaults.get("geometry", {}))
+            geometry.update(entry.get("geometry", {}))
+            parameters["scanPoints"] = rasterRows(geometry)
+        collector = LCLScollector(self.motorThread)
+        for key in parameters:
+            if key not in self.RUNNER_KEYS:
+                collector.setParameter(key, parameters[key])
+        return (entry, collector)
+
+
+def rasterRows(geometry):
+    """Computes the scan rows of a chip the same way the GUI builds its raster from settings.cfg.
+
+    Keyword arguments:
+    geometry -- dictionary with topLeft as (x, y), width, height and angle of the raster in pixels
+                and degrees, conversion in pixels per um, holePitch, beamSize, yzPitch and
+                beamOffset as (x, y) in um
+
+    Return value:
+    list of rows, each a list of QPointF in um
+
+    """
+    raster = Raster()
+    raster.setPixmapSize(12000, 12000)
+    raster.setConversion(geometry["conversion"])
+    raster.setStepsize(geometry["holePitch"], 13.0)
+    raster.setBeamsize(geometry["beamSize"], geometry["beamSize"])
+    raster.setPitch(geometry.get("yzPitch", 0.0))
+    raster.setScanType(Raster.RASTER_SCAN_TRIANGULAR)
+    offsetX, offsetY = geometry.get("beamOffset", (0.0, 0.0))
+    raster.setOffset(offsetX / geometry["conversion"], offsetY / geometry["conversion"])
+    topLeft = QtCore.QPointF(*geometry["topLeft"])
+    raster.setAllCorners(topLeft)
+    raster.expandRight(geometry["width"])
+    raster.expandBottom(geometry["height"])
+    raster.rotate(angle=geometry["angle"], anchor=topLeft)
+    return raster.getScanRows()
+
+
+def configDefaults(config):
+    """Returns the scan parameters and the chip geometry last used by the GUI, see StartQT4.saveSettings.
+
+    """
+    conversion = config.getfloat('SavedSettings', 'scale')
+    defaults = { \
+        "angle": config.getfloat('SavedSettings', 'gridangle'), \
+        "freq": config.getint('SavedSettings', 'frequency'), \
+        "acclPulses": config.getint('SavedSettings', 'accpulses'), \
+        "gonioStart": config.getfloat('SavedSettings', 'angleincstart'), \
+        "gonioStop": config.getfloat('SavedSettings', 'angleincstop'), \
+        "startRow": config.getint('SavedSettings', 'startrow'), \
+        "stopRow": config.getint('SavedSettings', 'stoprow'), \
+        "geometry": { \
+            "topLeft": (config.getfloat('Grid', 'topleftx'), config.getfloat('Grid', 'toplefty')), \
+            "width": config.getfloat('Grid', 'width'), \
+            "height": config.getfloat('Grid', 'height'), \
+            "angle": config.getfloat('Grid', 'angle'), \
+            "conversion": conversion, \
+            "holePitch": config.getfloat('SavedSettings', 'holepitch'), \
+            "beamSize": config.getfloat('SavedSettings', 'beamsize'), \
+            "yzPitch": config.getfloat('SavedSettings', 'yzpitch'), \
+            "beamOffset": (config.getfloat('SavedSettings', 'beamx'), config.getfloat('SavedSettings', 'beamy')), \
+        }, \
+    }
+    for option, key, get in (("scanmode", "mode", config.get), ("beamdumpretry", "retryMode", config.get), \
+                             ("beamdumpretries", "maxRetries", config.getint), ("beamstabletime", "stableTime", config.getfloat)):
+        if config.has_option('ISMOscan', option):
+            defaults[key] = get('ISMOscan', option)
+    return defaults
+
+
+def motorThreadFromConfig(config):
+    # same devices and options as StartQT4.loadSettings
+    from motorThread import MotorThread
+    servers = [config.get('ISMOscan', name) for name in ("scancontroller", "steppercontroller", "scanx", "scany", \
+               "gonio", "gonioz", "onaxisx", "onaxisy", "onaxisz", "beamstopx", "beamstopy")]
+    motorEvents = config.has_option('ISMOscan', 'motorevents') and config.getboolean('ISMOscan', 'motorevents')
+    statsInterval = 0
+    if config.has_option('ISMOscan', 'statsinterval'):
+        statsInterval = config.getfloat('ISMOscan', 'statsinterval')
+    pollRates = {}
+    if config.has_section('PollRates'):
+        for device, rates in config.items('PollRates'):
+            moving, idle = rates.split(",")
+            pollRates[device] = (float(moving), float(idle))
+    return MotorThread(servers, config.get('ISMOscan', 'onaxisZmountposition'), config.get('ISMOscan', 'gonioZmountposition'), \
+                       useEvents=motorEvents, pollRates=pollRates, statsInterval=statsInterval)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print "usage: python scanRunner.py queue.json"
+        sys.exit(1)
+    app = QtCore.QCoreApplication(sys.argv)
+    config = ConfigParser.ConfigParser()
+    config.read(os.path.realpath(os.path.dirname(sys.argv[0])) + '/' + "settings.cfg")
+    f = open(sys.argv[1], 'r')
+    entries = json.load(f)
+    f.close()
+    motorThread = motorThreadFromConfig(config)
+    # the runner waits until the devices are connected before it starts the first chip
+    motorThread.start()
+    runner = ScanRunner(motorThread, configDefaults(config))
+    for entry in entries:
+        runner.add(entry)
+
+    def exchangeChip(entry):
+        raw_input("Chip %s done, exchange the chip and press enter to continue." % entry["name"])
+        runner.resume()
+
+    def queueFinished():
+        motorThread.stop()
+        app.quit()
+
+    runner.connect(runner, SIGNAL("chipExchange(PyQt_PyObject)"), exchangeChip)
+    runner.connect(runner, SIGNAL("queueFinished()"), queueFinished)
+    runner.start()
+    sys.exit(app.exec_())
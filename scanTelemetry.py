@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Provides ScanTelemetry, a per row log of where the time of a raster scan goes.
+
+"""
+
+import sys
+import json
+import time
+import threading
+import Queue
+
+
+class ScanTelemetry():
+    """Collects one record per row with the duration of every phase of the row
+    and writes it as a JSON line to an append-only file. Records are written by a
+    background thread, so a slow disk never delays the scan. The summary of all
+    rows is kept in memory and available at any time.
+
+    """
+
+    # phases of a row in the order they happen, in seconds
+    PHASES = ("move", "format", "upload", "start", "run", "total")
+
+    def __init__(self, path=None):
+        """Keyword arguments:
+        path -- log file, records are appended (default None, records are only summarised)
+
+        """
+        self.path = path
+        self.records = []
+        self.queue = Queue.Queue()
+        self.writer = None
+        if path is not None:
+            self.writer = threading.Thread(target=self.write)
+            self.writer.daemon = True
+            self.writer.start()
+
+    def record(self, record):
+        """Logs the record of a row and returns at once.
+
+        Keyword arguments:
+        record -- dictionary with the durations of the PHASES present for the row, plus any other
+                  values under keys that are not phases, e.g. row, beamDump and startTime
+
+        """
+        record = dict(record)
+        record.setdefault("time", time.time())
+        self.records.append(record)
+        if self.writer is not None:
+            self.queue.put(record)
+
+    def close(self, timeout=5.0):
+        # waits for the writer to flush all records
+        if self.writer is None:
+            return
+        self.queue.put(None)
+        self.writer.join(timeout)
+        self.writer = None
+
+    def write(self):
+        f = open(self.path, "a")
+        try:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                f.write(json.dumps(record) + "\n")
+                # only flush once the backlog is written, a burst of records costs one write
+                if self.queue.empty():
+                    f.flush()
+        except:
+            print "Scan telemetry: writing", self.path, "failed:", sys.exc_info()[1]
+        finally:
+            f.close()
+
+    def summary(self):
+        """Returns statistics of all rows recorded so far.
+
+        Return value:
+        dictionary {phase: {"count", "mean", "min", "max", "sum"}} for every phase with at least one
+        value, plus "rows" and "beamDumps"
+
+        """
+        summary = {"rows": len(self.records), "beamDumps": len([r for r in self.records if r.get("beamDump")])}
+        for phase in self.PHASES:
+            values = [r[phase] for r in self.records if r.get(phase) is not None]
+            if values:
+                summary[phase] = {"count": len(values), "mean": sum(values) / len(values), \
+                                  "min": min(values), "max": max(values), "sum": sum(values)}
+        return summary
+
+    def summaryText(self):
+        """Returns the summary as readable text, one line per phase with its share of the total row time.
+
+        """
+        summary = self.summary()
+        lines = ["%d rows, %d beam dumps" % (summary["rows"], summary["beamDumps"])]
+        total = summary.get("total", {}).get("sum", 0.0)
+        for phase in self.PHASES:
+            if phase not in summary:
+                continue
+            s = summary[phase]
+            share = ""
+            if total > 0 and phase != "total":
+                share = ", %.0f%% of the row time" % (100.0 * s["sum"] / total)
+            lines.append("%-6s mean %.3f s, min %.3f s, max %.3f s%s" % (phase, s["mean"], s["min"], s["max"], share))
+        return "\n".join(lines)
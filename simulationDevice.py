@@ -108,6 +108,15 @@ class SimulationDevice():
                     value = self.attributes[str(name)]
             return SimulationAttribute(value)
 
+        def read_attributes(self, names):
+            attributes = []
+            for name in names:
+                if name == "State" or name == "state":
+                    attributes.append(SimulationAttribute(self.state()))
+                else:
+                    attributes.append(self.read_attribute(name))
+            return attributes
+
         def command_inout(self,name,value=0):
             if name == "StartStandardAcq":
                 self.StartStandardAcq()
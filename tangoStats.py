@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Provides InstrumentedProxy, a wrapper around DeviceProxy or SimulationDevice
+that records the latency of every Tango call, and LatencyStats, which collects
+latency histograms, error counts and call rates per device and attribute/command.
+
+"""
+
+import sys
+import threading
+import time
+
+
+class LatencyStats():
+    """Thread safe collection of call statistics, keyed by (device, call, name),
+    e.g. ("ScanX", "read_attribute", "Position").
+
+    """
+
+    # upper bounds of the histogram buckets in seconds, the last bucket takes everything above
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.startTime = time.time()
+
+    def record(self, device, call, name, duration, error=False):
+        key = (device, call, name)
+        bucket = len(self.BUCKETS)
+        for i in range(len(self.BUCKETS)):
+            if duration <= self.BUCKETS[i]:
+                bucket = i
+                break
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {"calls": 0, "errors": 0, "total": 0.0, "max": 0.0, "first": time.time(), \
+                         "histogram": [0] * (len(self.BUCKETS) + 1)}
+                self.entries[key] = entry
+            entry["calls"] += 1
+            entry["total"] += duration
+            entry["max"] = max(entry["max"], duration)
+            entry["histogram"][bucket] += 1
+            if error:
+                entry["errors"] += 1
+
+    def snapshot(self):
+        """Returns a copy of the statistics.
+
+        Return value:
+        dictionary {(device, call, name): {"calls", "errors", "mean", "max", "p50", "p95", "rate", "histogram"}}
+        with times in seconds and the rate in calls per second
+
+        """
+        now = time.time()
+        result = {}
+        with self.lock:
+            for key, entry in self.entries.items():
+                calls = entry["calls"]
+                result[key] = { \
+                    "calls": calls, \
+                    "errors": entry["errors"], \
+                    "mean": entry["total"] / calls, \
+                    "max": entry["max"], \
+                    "p50": self.percentile(entry["histogram"], 0.5), \
+                    "p95": self.percentile(entry["histogram"], 0.95), \
+                    "rate": calls / max(now - entry["first"], 1e-3), \
+                    "histogram": list(entry["histogram"]), \
+                }
+        return result
+
+    def percentile(self, histogram, fraction):
+        # upper bound of the bucket containing the given fraction of all calls
+        limit = fraction * sum(histogram)
+        count = 0
+        for i in range(len(histogram)):
+            count += histogram[i]
+            if count >= limit and count > 0:
+                if i < len(self.BUCKETS):
+                    return self.BUCKETS[i]
+                return float("inf")
+        return 0.0
+
+    def dump(self, out=None):
+        """Prints a table of the current statistics, slowest calls first.
+
+        """
+        if out is None: out = sys.stdout
+        stats = self.snapshot()
+        out.write("Tango call statistics:\n")
+        out.write("%-20s %-16s %-20s %8s %6s %9s %9s %9s %9s %8s\n" % \
+            ("device", "call", "name", "calls", "errors", "mean/ms", "p50/ms", "p95/ms", "max/ms", "rate/Hz"))
+        for key in sorted(stats, key=lambda key: -stats[key]["mean"]):
+            entry = stats[key]
+            out.write("%-20s %-16s %-20s %8d %6d %9.2f %9.1f %9.1f %9.2f %8.2f\n" % \
+                (key[0], key[1], key[2], entry["calls"], entry["errors"], 1000 * entry["mean"], \
+                 1000 * entry["p50"], 1000 * entry["p95"], 1000 * entry["max"], entry["rate"]))
+        out.flush()
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+            self.startTime = time.time()
+
+
+# statistics shared by all instrumented proxies unless told otherwise
+stats = LatencyStats()
+
+
+class InstrumentedProxy():
+    """Wraps a DeviceProxy or SimulationDevice and times all Tango calls going
+    through it. Everything else is passed on to the wrapped proxy unchanged.
+
+    """
+
+    TIMED_CALLS = ("read_attribute", "read_attributes", "write_attribute", "command_inout", "state", "status")
+
+    def __init__(self, proxy, name=None, latencyStats=None):
+        """Keyword arguments:
+        proxy -- DeviceProxy or SimulationDevice to wrap
+        name -- device name used in the statistics (default the Tango device name)
+        latencyStats -- LatencyStats instance to record into (default the shared tangoStats.stats)
+
+        """
+        if name is None:
+            try:
+                name = proxy.dev_name()
+            except:
+                name = proxy.__class__.__name__
+        if latencyStats is None:
+            latencyStats = stats
+        self.proxy = proxy
+        self.name = name
+        self.latencyStats = latencyStats
+
+    def __getattr__(self, attr):
+        value = getattr(self.proxy, attr)
+        if attr not in self.TIMED_CALLS:
+            return value
+        def timed(*args, **kwargs):
+            name = ""
+            if args:
+                name = args[0]
+                if isinstance(name, (list, tuple)):
+                    name = ",".join(name)
+            start = time.time()
+            try:
+                result = value(*args, **kwargs)
+            except:
+                self.latencyStats.record(self.name, attr, str(name), time.time() - start, True)
+                raise
+            self.latencyStats.record(self.name, attr, str(name), time.time() - start)
+            return result
+        return timed